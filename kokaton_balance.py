@@ -0,0 +1,271 @@
+"""
+こうかとんインベーダーの難易度調整用バッチシミュレータ
+パラメータ（レベルごとの出現間隔，敵機の爆弾投下インターバル，ボスの体力，強化ビームの消費MP）の
+組み合わせごとに，ボットに画面なしで何ゲームも遊ばせ，生存時間・スコア・スプライト数の分布をまとめる
+ゲームはプロセスプールで全コアに分けて動かす
+
+使い方
+  python kokaton_balance.py --games 50                                  # 今の設定で50ゲーム
+  python kokaton_balance.py --lv-scale 0.8,1,1.25 --boss-hp 100,200     # 3×2通りを比べる
+  python kokaton_balance.py --interval 50-300,100-400 --mp-costs 1/5/7,2/5/9 --out balance.json
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import pygame as pg
+
+import kokaton_invader as ki
+from kokaton_bench import percentile
+
+
+BASE_LV_DIC = dict(ki.Lv.lv_dic)  # 出現間隔の倍率を掛ける前の値
+
+
+def dodge_policy(seed: int):
+    """
+    爆弾がこうかとんの高さに来るときの横位置を予測して避けながら左右に動き回り，
+    ビームを撃ち，MPがたまったら強化ビームを使うボットの入力関数を返す
+    ゲーム本体の乱数とは別の乱数列を使うので，ゲームの乱数列を乱さない
+    引数 seed：ボットの乱数シード
+    """
+    rng = random.Random(seed)
+    keys = {"e": pg.K_e, "w": pg.K_w, "q": pg.K_q}
+    state = {"move": pg.K_LEFT}
+
+    def policy(frame, game):
+        bird = game.bird.rect
+        threat = None  # いちばん早く当たりそうな爆弾の(到達までのtick数, 予測した横位置)
+        for bomb in game.bombs:
+            dy = bird.centery - bomb.rect.centery
+            if bomb.vy <= 0 or dy < 0:
+                continue
+            ticks = dy/(bomb.speed*bomb.vy)
+            x = bomb.rect.centerx + bomb.vx/bomb.vy*dy
+            if ticks < 40 and abs(x - bird.centerx) < bird.width//2 + bomb.rect.width//2 + 10:
+                if threat is None or ticks < threat[0]:
+                    threat = (ticks, x)
+        if threat is not None:
+            state["move"] = pg.K_LEFT if threat[1] >= bird.centerx else pg.K_RIGHT
+        elif rng.random() < 0.02:
+            state["move"] = rng.choice([pg.K_LEFT, pg.K_RIGHT])
+        if bird.left < 40:  # 壁際では向きを変える
+            state["move"] = pg.K_RIGHT
+        elif bird.right > ki.WIDTH - 40:
+            state["move"] = pg.K_LEFT
+        held = {state["move"]}
+        if frame % 2 == 0:
+            held.add(pg.K_SPACE)
+        elif frame % 10 == 1:
+            for name in ["q", "w", "e"]:  # 強いものから，MPが足りるものを使う
+                if game.mp.value >= ki.MP.costs[name]:
+                    held.add(keys[name])
+                    break
+        return held
+    return policy
+
+
+POLICIES = {"bot": ki.bot_policy, "dodge": dodge_policy}
+
+
+def parse_list(text: str, conv) -> list:
+    """
+    カンマ区切りの文字列を値のリストにする
+    """
+    return [conv(item) for item in text.split(",") if item]
+
+
+def parse_range(text: str) -> tuple[int, int]:
+    """
+    「最小-最大」の文字列を(最小, 最大)にする
+    """
+    low, high = text.split("-")
+    return int(low), int(high)
+
+
+def parse_costs(text: str) -> dict:
+    """
+    「E/W/Q」の文字列を強化ビームごとの消費MPの辞書にする
+    """
+    return dict(zip(["e", "w", "q"], (int(num) for num in text.split("/"))))
+
+
+def make_grid(args) -> list:
+    """
+    コマンドライン引数からパラメータの全組み合わせのリストを作る
+    """
+    grid = itertools.product(
+        parse_list(args.lv_scale, float),
+        parse_list(args.interval, parse_range),
+        parse_list(args.boss_hp, int),
+        parse_list(args.mp_costs, parse_costs),
+    )
+    return [{"lv_scale": scale, "interval": interval, "boss_hp": hp, "mp_costs": costs}
+            for scale, interval, hp, costs in grid]
+
+
+def apply_params(params: dict):
+    """
+    パラメータをゲームのクラス変数に設定する（プロセスごとに1ゲームずつ動かすので，ゲームの前に毎回設定する）
+    """
+    ki.Lv.lv_dic = {lv: max(1, round(freq*params["lv_scale"])) for lv, freq in BASE_LV_DIC.items()}
+    ki.Enemy.interval_range = tuple(params["interval"])
+    ki.Boss.max_hp = params["boss_hp"]
+    ki.MP.costs = dict(params["mp_costs"])
+
+
+def init_worker():
+    """
+    ワーカープロセスの初期化：画面と画像をプロセスごとに1回だけ用意する
+    """
+    pg.init()
+    pg.display.set_mode((ki.WIDTH, ki.HEIGHT))
+    ki.preload_assets()
+
+
+def play(task: tuple) -> dict:
+    """
+    1ゲームをこうかとんがやられるかmax_ticksに達するまで動かし，結果を返す
+    描画はしないでゲームの進行（Game.simulate）だけを行う
+    simulateは描画の状態（Rendererの更新矩形など）に触れないので，長いゲームでもワーカーに溜まるものはない
+    引数 task：(組み合わせ番号, パラメータ, 乱数シード, ボットの名前, 最大tick数)
+    """
+    index, params, seed, policy, max_ticks = task
+    apply_params(params)
+    random.seed(seed)
+    inputs = ki.ScriptedInput(POLICIES[policy](seed))
+    game = ki.Game(pg.display.get_surface())
+    peak = game.counts()
+    alive = True
+    while alive and game.tmr < max_ticks:
+        key_lst, events = inputs.poll(game.tmr, game)
+        alive = game.simulate(key_lst, events)
+        for name, num in game.counts().items():
+            if num > peak[name]:
+                peak[name] = num
+    if game.renderer.rects:  # 描画しないまま更新矩形が溜まっていく（simulateで描画している）
+        raise RuntimeError(f"Game.simulateが描画しました（更新矩形{len(game.renderer.rects)}個）")
+    return {
+        "index": index,
+        "seed": seed,
+        "died": not alive,
+        "ticks": game.tmr,
+        "score": game.score.value,
+        "level": game.lv.lv,
+        "peak_counts": peak,
+    }
+
+
+def summarize(params: dict, games: list) -> dict:
+    """
+    1つの組み合わせのゲーム結果をまとめる
+    """
+    seconds = [game["ticks"]/ki.Game.tick_rate for game in games]
+    scores = [game["score"] for game in games]
+    return {
+        "params": params,
+        "games": len(games),
+        "deaths": sum(game["died"] for game in games),
+        "survival_s": {
+            "mean": sum(seconds)/len(seconds),
+            "p10": percentile(seconds, 10),
+            "p50": percentile(seconds, 50),
+            "p90": percentile(seconds, 90),
+        },
+        "score": {
+            "mean": sum(scores)/len(scores),
+            "p10": percentile(scores, 10),
+            "p50": percentile(scores, 50),
+            "p90": percentile(scores, 90),
+            "max": max(scores),
+        },
+        "level_mean": sum(game["level"] for game in games)/len(games),
+        "peak_counts": {
+            name: {
+                "mean": sum(game["peak_counts"][name] for game in games)/len(games),
+                "max": max(game["peak_counts"][name] for game in games),
+            }
+            for name in games[0]["peak_counts"]
+        },
+    }
+
+
+def label(params: dict) -> str:
+    """
+    組み合わせを表の1列に収まる文字列にする
+    """
+    costs = params["mp_costs"]
+    return (f"lv x{params['lv_scale']:g} int {params['interval'][0]}-{params['interval'][1]} "
+            f"boss {params['boss_hp']} mp {costs['e']}/{costs['w']}/{costs['q']}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="こうかとんインベーダーの難易度調整用バッチシミュレータ")
+    parser.add_argument("--lv-scale", default="1",
+                        help="レベルごとの敵機の出現間隔に掛ける倍率（カンマ区切りで複数）")
+    parser.add_argument("--interval", default="50-300",
+                        help="敵機の爆弾投下インターバルの範囲tick「最小-最大」（カンマ区切りで複数）")
+    parser.add_argument("--boss-hp", default="100", help="ボスの体力（カンマ区切りで複数）")
+    parser.add_argument("--mp-costs", default="1/5/7",
+                        help="強化ビームE/W/Qの消費MP「E/W/Q」（カンマ区切りで複数）")
+    parser.add_argument("--games", type=int, default=20, help="組み合わせごとのゲーム数")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="最初の乱数シード（どの組み合わせも同じシード列で比べる）")
+    parser.add_argument("--policy", choices=list(POLICIES), default="dodge", help="操作するボット")
+    parser.add_argument("--max-seconds", type=int, default=600,
+                        help="1ゲームの最大時間（ゲーム内の秒，これを超えたら生き残りとして打ち切る）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="並列に動かすプロセス数（既定はCPUコア数）")
+    parser.add_argument("--out", default="balance.json", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    grid = make_grid(args)
+    max_ticks = args.max_seconds*ki.Game.tick_rate
+    # 同じシードのゲームが組み合わせごとに並ばないように，シードを外側にして投入する
+    tasks = [(index, params, args.seed + num, args.policy, max_ticks)
+             for num in range(args.games) for index, params in enumerate(grid)]
+    results = [[] for _ in grid]
+    chunksize = max(1, len(tasks)//(args.workers*8))
+    print(f"{len(grid)} 組み合わせ × {args.games} ゲーム = {len(tasks)} ゲームを {args.workers} プロセスで実行",
+          file=sys.stderr)
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(args.workers, initializer=init_worker) as pool:
+        for done, game in enumerate(pool.map(play, tasks, chunksize=chunksize), 1):
+            results[game["index"]].append(game)
+            if done % max(1, len(tasks)//10) == 0:
+                print(f"  {done}/{len(tasks)} ({time.perf_counter() - start:.1f} s)", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "meta": {
+            "games": len(tasks),
+            "games_per_params": args.games,
+            "seed": args.seed,
+            "policy": args.policy,
+            "max_seconds": args.max_seconds,
+            "workers": args.workers,
+            "seconds": elapsed,
+        },
+        "results": [summarize(params, games) for params, games in zip(grid, results)],
+    }
+    for res in report["results"]:
+        surv, score = res["survival_s"], res["score"]
+        print(f"{label(res['params']):42s} died {res['deaths']:4d}/{res['games']:<4d} "
+              f"survival p50 {surv['p50']:6.1f} s (p10 {surv['p10']:6.1f}, p90 {surv['p90']:6.1f})  "
+              f"score mean {score['mean']:6.1f} p50 {score['p50']:4d} max {score['max']:4d}  "
+              f"Lv {res['level_mean']:.1f}  peak emys {res['peak_counts']['emys']['max']} "
+              f"bombs {res['peak_counts']['bombs']['max']}")
+    print(f"{len(tasks)} games in {elapsed:.1f} s ({len(tasks)/elapsed:.1f} games/s)")
+    with open(args.out, "w", encoding="utf-8") as wf:
+        json.dump(report, wf, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
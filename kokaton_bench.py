@@ -0,0 +1,371 @@
+"""
+こうかとんインベーダーのベンチマーク
+決まったシナリオでGameを動かし，フェーズごとの処理時間やフレーム時間をJSONに記録する
+
+使い方
+  python kokaton_bench.py run --out bench.json            # 全シナリオを計測
+  python kokaton_bench.py run --scenario q_spam           # 1つだけ計測
+  python kokaton_bench.py compare baseline.json bench.json  # 基準値と比べて遅くなったものを表示
+  python kokaton_bench.py micro                           # 爆弾生成のマイクロベンチマーク
+  python kokaton_bench.py explosions                      # 爆発エフェクトをスプライトと粒子で比べる
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import pygame as pg
+
+import kokaton_invader as ki
+
+
+PHASES = ki.FrameProfiler.phases  # Game.frameが計測するフェーズ
+
+
+def percentile(values: list, q: float) -> float:
+    """
+    値のリストのq（0～100）パーセンタイルを返す
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def setup_stopped_enemies(game: ki.Game):
+    """
+    500体の停止済みの敵機が爆弾を落とし続ける
+    """
+    for _ in range(500):
+        emy = ki.Enemy()
+        emy.rect.centery = emy.bound + 1
+        emy.vy = 0
+        emy.state = "stop"
+        game.add_enemy(emy)
+
+
+def setup_q_spam(game: ki.Game):
+    """
+    MPを使い切らない状態でQビームを撃ち続ける
+    """
+    game.mp.value = 10**9
+
+
+def setup_boss_fight(game: ki.Game):
+    """
+    停止済みのボスと戦う（爆弾は常に200個）
+    """
+    boss = ki.Boss()
+    boss.rect.centery = boss.bound + 1
+    boss.vy = 0
+    boss.state = "stop"
+    game.add_boss(boss)
+    game.boss_spown = True
+    game.mp.value = 10**9
+
+
+def keep_boss_fight(game: ki.Game):
+    """
+    ボスの体力と爆弾200個を保つ
+    """
+    for boss in game.bosses:
+        boss.hp = 100
+        while len(game.bombs) < 200:
+            bomb = ki.Bomb.new(None, boss, game.bird)
+            bomb.rect.centerx = random.randint(40, ki.WIDTH - 40)
+            bomb.rect.centery = random.randint(200, ki.HEIGHT - 200)
+            game.bombs.add(bomb)
+
+
+SCENARIOS = {
+    "stopped_enemies": {
+        "setup": setup_stopped_enemies,
+        "keys": lambda frame: [pg.K_SPACE] if frame % 2 == 0 else [],
+    },
+    "q_spam": {
+        "setup": setup_q_spam,
+        "keys": lambda frame: [pg.K_q, pg.K_SPACE] if frame % 2 == 0 else [pg.K_q],
+    },
+    "boss_fight": {
+        "setup": setup_boss_fight,
+        "keys": lambda frame: [pg.K_SPACE, pg.K_e] if frame % 2 == 0 else [],
+        "every_frame": keep_boss_fight,
+    },
+}
+
+
+class BenchGame(ki.Game):
+    """
+    こうかとんが爆弾に当たってもやられないGame（シナリオの負荷を保ったまま毎フレーム最後まで進める）
+    """
+    def collide(self) -> bool:
+        super().collide()
+        return True
+
+
+def run_scenario(name: str, frames: int, warmup: int, seed: int, pool_size: int = 256,
+                 projectiles: str = "sprite") -> dict:
+    """
+    シナリオを1つ動かして計測結果を返す
+    ゲームと同じGame.frameで1フレームずつ進め，フェーズごとの時間はFrameProfilerで測る
+    こうかとんが爆弾に当たってもゲームは続ける
+    """
+    scenario = SCENARIOS[name]
+    ki.configure_pools(pool_size)
+    random.seed(seed)
+    profiler = ki.FrameProfiler()
+    profiler.active = True  # 画面表示もCSVも使わずに計測だけ行う
+    # 品質を下げると計測する処理が変わるので，FrameGovernorは予算なし（常に最高品質）にする
+    game = BenchGame(pg.display.get_surface(), "dirty", profiler, projectiles, governor=ki.FrameGovernor(0))
+    scenario["setup"](game)
+    every_frame = scenario.get("every_frame")
+    key_lst = ki.KeyState()
+    phase_ms = {phase: [] for phase in PHASES}
+    frame_ms = []
+    blocks = []
+    gc_before = sum(stat["collections"] for stat in gc.get_stats())
+    peak = game.counts()
+    for frame in range(warmup + frames):
+        pg.event.pump()
+        events = [pg.event.Event(pg.KEYDOWN, key=key) for key in scenario["keys"](frame)]
+        if every_frame:
+            every_frame(game)
+        blocks_start = sys.getallocatedblocks()
+        game.frame(key_lst, events)
+        if frame < warmup:
+            continue
+        blocks.append(sys.getallocatedblocks() - blocks_start)
+        for phase in PHASES:
+            phase_ms[phase].append(profiler.times.get(phase, 0.0))
+        frame_ms.append(profiler.totals[-1])
+        for key, num in game.counts().items():
+            peak[key] = max(peak[key], num)
+    gc_after = sum(stat["collections"] for stat in gc.get_stats())
+    return {
+        "frames": frames,
+        "frame_ms": {
+            "mean": sum(frame_ms) / len(frame_ms),
+            "p50": percentile(frame_ms, 50),
+            "p99": percentile(frame_ms, 99),
+        },
+        "phases_ms": {phase: sum(vals) / len(vals) for phase, vals in phase_ms.items()},
+        "phases_p99_ms": {phase: percentile(vals, 99) for phase, vals in phase_ms.items()},
+        "alloc_blocks_per_frame": sum(blocks) / len(blocks),
+        "alloc_blocks_p99": percentile(blocks, 99),
+        "gc_collections": gc_after - gc_before,
+        "peak_counts": peak,
+        "pools": ki.pool_stats(),
+    }
+
+
+def cmd_run(args) -> int:
+    """
+    ベンチマークを実行してJSONに書き出す
+    """
+    pg.init()
+    pg.display.set_mode((ki.WIDTH, ki.HEIGHT))
+    ki.preload_assets()
+    names = args.scenario or list(SCENARIOS)
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "pygame": pg.version.ver,
+            "platform": platform.platform(),
+            "frames": args.frames,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "pool_size": args.pool_size,
+            "projectiles": args.projectiles,
+        },
+        "scenarios": {},
+    }
+    for name in names:
+        res = run_scenario(name, args.frames, args.warmup, args.seed, args.pool_size, args.projectiles)
+        results["scenarios"][name] = res
+        print(f"{name:16s} p50 {res['frame_ms']['p50']:7.3f} ms  p99 {res['frame_ms']['p99']:7.3f} ms  "
+              + "  ".join(f"{phase} {ms:.3f}" for phase, ms in res["phases_ms"].items()))
+    with open(args.out, "w", encoding="utf-8") as wf:
+        json.dump(results, wf, indent=2)
+    pg.quit()
+    return 0
+
+
+class LegacyBomb(pg.sprite.Sprite):
+    """
+    爆弾アトラス導入前のBomb（爆弾ごとにSurfaceを作って円を描く）
+    """
+    def __init__(self, emy: ki.Enemy, boss: ki.Boss, bird: ki.Bird):
+        super().__init__()
+        rad = 10
+        self.image = pg.Surface((2*rad, 2*rad))
+        color = random.choice(ki.Bomb.colors)
+        pg.draw.circle(self.image, color, (rad, rad), rad)
+        self.image.set_colorkey((0, 0, 0))
+        self.rect = self.image.get_rect()
+        if boss:
+            brad = 30
+            self.image = pg.Surface((2*brad, 2*brad))
+            color = random.choice(ki.Bomb.colors)
+            pg.draw.circle(self.image, color, (brad, brad), brad)
+            self.image.set_colorkey((0, 0, 0))
+            self.rect = self.image.get_rect()
+            self.vx, self.vy = ki.calc_orientation(boss.rect, bird.rect)
+            self.rect.centerx = boss.rect.centerx
+            self.rect.centery = boss.rect.centery+boss.rect.height//2
+            self.speed = 10
+        else:
+            self.vx, self.vy = ki.calc_orientation(emy.rect, bird.rect)
+            self.rect.centerx = emy.rect.centerx
+            self.rect.centery = emy.rect.centery+emy.rect.height//2
+            self.speed = 6
+
+
+def cmd_micro(args) -> int:
+    """
+    同じフレームに多数の敵機が爆弾を投下するときの生成コストを，
+    爆弾ごとにSurfaceを作る方式とアトラスを共有する方式で比べる
+    """
+    pg.init()
+    pg.display.set_mode((ki.WIDTH, ki.HEIGHT))
+    ki.preload_assets()
+    random.seed(args.seed)
+    bird = ki.Bird(3, (325, 650))
+    emys = []
+    for _ in range(args.bombs):
+        emy = ki.Enemy()
+        emy.rect.centery = emy.bound + 1
+        emys.append(emy)
+    boss = ki.Boss()
+    boss.rect.centery = boss.bound + 1
+    results = {}
+    for label, make in [("legacy", lambda emy, b: LegacyBomb(emy, b, bird)),
+                        ("atlas", lambda emy, b: ki.Bomb(emy, b, bird))]:
+        for kind, src in [("enemy", None), ("boss", boss)]:
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                for emy in emys:
+                    make(emy, src)
+                times.append((time.perf_counter() - start) * 1000)
+            results[f"{label}_{kind}_ms"] = percentile(times, 50)
+            print(f"{label:7s} {kind:6s} {args.bombs} bombs/frame: p50 {percentile(times, 50):7.3f} ms")
+    for kind in ("enemy", "boss"):
+        print(f"{kind:6s} speedup {results[f'legacy_{kind}_ms'] / results[f'atlas_{kind}_ms']:.2f}x")
+    pg.quit()
+    return 0
+
+
+def cmd_explosions(args) -> int:
+    """
+    W/Qビームで敵機をまとめて倒したときのように，数フレームおきに多数の爆発を出し続け，
+    爆発エフェクトの生成・移動・描画の時間をExplosionスプライトとParticleSystemで比べる
+    """
+    pg.init()
+    pg.display.set_mode((ki.WIDTH, ki.HEIGHT))
+    ki.preload_assets()
+    screen = pg.display.get_surface()
+    results = {}
+    for effects in ("sprite", "particles"):
+        random.seed(args.seed)
+        game = ki.Game(screen, "dirty", effects=effects)
+        targets = []
+        for _ in range(args.burst):
+            emy = ki.Enemy()
+            emy.rect.center = (random.randint(40, ki.WIDTH - 40), random.randint(40, ki.HEIGHT//2))
+            targets.append(emy)
+        times = []
+        peak = 0
+        for frame in range(args.warmup + args.frames):
+            start = time.perf_counter()
+            game.renderer.begin()
+            if frame % args.every == 0:
+                for emy in targets:
+                    game.explode(emy, 100)
+            game.exps.update()
+            game.renderer.draw(game.exps)
+            game.renderer.flip()
+            if frame >= args.warmup:
+                times.append((time.perf_counter() - start) * 1000)
+                peak = max(peak, len(game.exps))
+        results[effects] = percentile(times, 50)
+        print(f"{effects:9s} {args.burst} explosions every {args.every} frames: "
+              f"p50 {percentile(times, 50):7.3f} ms  p99 {percentile(times, 99):7.3f} ms  peak drawn {peak}")
+    print(f"speedup {results['sprite'] / results['particles']:.2f}x")
+    pg.quit()
+    return 0
+
+
+def cmd_compare(args) -> int:
+    """
+    基準値のJSONと比べて，閾値以上遅くなった指標を表示する
+    戻り値：遅くなった指標があれば1
+    """
+    with open(args.baseline, "r", encoding="utf-8") as rf:
+        base = json.load(rf)["scenarios"]
+    with open(args.current, "r", encoding="utf-8") as rf:
+        cur = json.load(rf)["scenarios"]
+    regressions = 0
+    for name, res in cur.items():
+        if name not in base:
+            print(f"{name}: no baseline")
+            continue
+        metrics = [("frame p50", base[name]["frame_ms"]["p50"], res["frame_ms"]["p50"]),
+                   ("frame p99", base[name]["frame_ms"]["p99"], res["frame_ms"]["p99"])]
+        metrics += [(phase, base[name]["phases_ms"][phase], res["phases_ms"][phase])
+                    for phase in PHASES if phase in base[name]["phases_ms"]]
+        for label, old, new in metrics:
+            ratio = new / old if old > 0 else 1.0
+            mark = ""
+            if ratio > 1 + args.threshold and new - old > args.min_ms:
+                mark = "  REGRESSION"
+                regressions += 1
+            print(f"{name:16s} {label:10s} {old:8.3f} -> {new:8.3f} ms ({ratio:5.2f}x){mark}")
+    return 1 if regressions else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="こうかとんインベーダーのベンチマーク")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="シナリオを計測してJSONに書き出す")
+    run.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                     help="計測するシナリオ（複数指定可，省略時はすべて）")
+    run.add_argument("--frames", type=int, default=500, help="計測するフレーム数")
+    run.add_argument("--warmup", type=int, default=50, help="計測前に捨てるフレーム数")
+    run.add_argument("--seed", type=int, default=0, help="乱数シード")
+    run.add_argument("--pool-size", type=int, default=256, help="スプライトプールの大きさ（0でプールしない）")
+    run.add_argument("--projectiles", choices=["sprite", "numpy"], default="sprite",
+                     help="ビーム・爆弾の持ち方")
+    run.add_argument("--out", default="bench.json", help="結果を書き出すJSONファイル")
+    run.set_defaults(func=cmd_run)
+    micro = sub.add_parser("micro", help="爆弾の生成コストを爆弾アトラスの有無で比べる")
+    micro.add_argument("--bombs", type=int, default=500, help="1フレームに投下する爆弾の数")
+    micro.add_argument("--repeat", type=int, default=50, help="繰り返す回数")
+    micro.add_argument("--seed", type=int, default=0, help="乱数シード")
+    micro.set_defaults(func=cmd_micro)
+    exps = sub.add_parser("explosions", help="爆発エフェクトの時間をスプライトと粒子で比べる")
+    exps.add_argument("--burst", type=int, default=30, help="一度に出す爆発の数")
+    exps.add_argument("--every", type=int, default=10, help="爆発を出すフレーム間隔")
+    exps.add_argument("--frames", type=int, default=500, help="計測するフレーム数")
+    exps.add_argument("--warmup", type=int, default=100, help="計測前に捨てるフレーム数")
+    exps.add_argument("--seed", type=int, default=0, help="乱数シード")
+    exps.set_defaults(func=cmd_explosions)
+    compare = sub.add_parser("compare", help="基準値と比べて遅くなった指標を表示する")
+    compare.add_argument("baseline", help="基準値のJSONファイル")
+    compare.add_argument("current", help="比べるJSONファイル")
+    compare.add_argument("--threshold", type=float, default=0.10,
+                         help="遅くなったとみなす割合（0.10なら10%%）")
+    compare.add_argument("--min-ms", type=float, default=0.05,
+                         help="これより小さい差は無視する（ミリ秒）")
+    compare.set_defaults(func=cmd_compare)
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
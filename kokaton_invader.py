@@ -1,10 +1,27 @@
+import argparse
+import ast
+import atexit
+import bisect
+import collections
+import gc
+import json
 import math
 import os
+import queue
 import random
+import sqlite3
 import sys
+import threading
 import time
+import zlib
 import pygame as pg
 from typing import Union
+try:
+    import numpy as np
+except ImportError:  # NumPyがなければ弾の配列エンジン（--projectiles numpy）と爆発の粒子（--effects particles）は使えない
+    np = None
+
+IMPORT_START = time.perf_counter(), time.process_time()  # このモジュールを読み込み始めた時刻とCPU時間
 
 
 KONAMI_COMMAND = [
@@ -12,16 +29,12 @@ KONAMI_COMMAND = [
     pg.K_LEFT, pg.K_RIGHT, pg.K_LEFT, pg.K_RIGHT,
     pg.K_b, pg.K_a
 ]
-TIMEOUT = 200  # タイムアウト間隔
-
-# 現在の入力状態を追跡する変数
-command_index = 0  # 現在のコマンドの位置
-tmr = 0  # タイマー
-command1 = False  # コマンドが成功したかのフラグ
+TIMEOUT = 200  # タイムアウト間隔（tick）
 
 WIDTH = 650  # ゲームウィンドウの幅
 HEIGHT = 750 # ゲームウィンドウの高さ
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # 画像フォルダ・ランキング・キャッシュを置くフォルダ
+ATLAS_CACHE = os.path.join(BASE_DIR, "kokaton_invader_atlas.cache")  # 加工済み画像のアトラスのキャッシュファイル
 
 
 ###この関数は引用
@@ -77,30 +90,855 @@ def calc_orientation(org: pg.Rect, dst: pg.Rect) -> tuple[float, float]:
     return x_diff/norm, y_diff/norm
 
 
-def check_konami_command(key_lst):
+class Assets:
     """
-    コマンドが入力されたかを確認する関数
-    引数 key_lst:現在のキー入力状態リスト
+    画像ファイルを一度だけ読み込み，変換済みSurfaceをキャッシュするクラス
+    回転・拡大縮小・反転などの加工結果も(ファイル名, 加工手順)をキーに保持する
     """
-    global command_index, tmr, command1
-    if command1 == True:
-        pass
-    if command1 == False:
-        # 指定したコマンドのキーが押されているかを確認
-        if key_lst[KONAMI_COMMAND[command_index]]:
-            command_index += 1  # 次のコマンドに進む
-            print(f"Command step: {command_index}")
-            tmr = 0  # タイマーをリセット
-
-            # コマンドがすべて成功した場合
-            if command_index == len(KONAMI_COMMAND):
-                command1 = True
-                command_index = 0  # コマンドの位置をリセット
-                print("Konami Command Activated!")
-        elif tmr >= TIMEOUT:  # タイムアウト条件
-            command_index = 0  # コマンドの位置をリセット
-
-            
+    def __init__(self, directory: str = os.path.join(BASE_DIR, "fig")):
+        """
+        引数 directory：画像ファイルのあるフォルダ
+        """
+        self.directory = directory
+        self.images = {}  # ファイル名→読み込み済みSurface
+        self.derived = {}  # (ファイル名, 加工手順タプル)→加工済みSurface
+        self.fonts = {}  # (フォント名, 大きさ)→Font
+        self.loads = 0  # ディスクから読み込んだ回数
+        self.hits = 0  # キャッシュヒット数
+        self.misses = 0  # キャッシュミス数
+
+    def load(self, name: str) -> pg.Surface:
+        """
+        画像ファイルを読み込む（2回目以降はキャッシュを返す）
+        画面が作成済みなら表示形式に変換してから保持する
+        引数 name：ファイル名
+        """
+        img = self.images.get(name)
+        if img is not None:
+            self.hits += 1
+            return img
+        self.misses += 1
+        self.loads += 1
+        img = pg.image.load(os.path.join(self.directory, name))
+        if pg.display.get_surface() is not None:
+            if name.endswith(".jpg"):
+                img = img.convert()
+            else:
+                img = img.convert_alpha()
+        self.images[name] = img
+        return img
+
+    def get(self, name: str, *ops: tuple) -> pg.Surface:
+        """
+        画像に加工を順に適用したSurfaceを返す
+        引数1 name：ファイル名
+        引数2以降 ops：("rotozoom", 角度, 倍率)，("rotate", 角度)，
+                       ("scale", (幅, 高さ))，("flip", 横, 縦) の加工手順
+        """
+        if not ops:
+            return self.load(name)
+        key = (name, ops)
+        img = self.derived.get(key)
+        if img is not None:
+            self.hits += 1
+            return img
+        self.misses += 1
+        src = self.get(name, *ops[:-1])
+        op, *args = ops[-1]
+        img = getattr(pg.transform, op)(src, *args)
+        self.derived[key] = img
+        return img
+
+    def font(self, name: str, size: int) -> pg.font.Font:
+        """
+        フォントを返す（同じ名前と大きさのフォントは1つだけ作る）
+        引数1 name：フォントファイル名（Noneなら既定のフォント）
+        引数2 size：文字の大きさ
+        """
+        font = self.fonts.get((name, size))
+        if font is None:
+            font = pg.font.Font(name, size)
+            self.fonts[name, size] = font
+        return font
+
+    def stats(self) -> dict:
+        """
+        キャッシュの統計を辞書で返す
+        """
+        return {
+            "fonts": len(self.fonts),
+            "loads": self.loads,
+            "hits": self.hits,
+            "misses": self.misses,
+            "images": len(self.images),
+            "derived": len(self.derived),
+        }
+
+
+assets = Assets()
+
+
+class SpriteAtlas:
+    """
+    加工済み画像を数枚の大きなSurface（ページ）に詰め込み，各画像をページの部分Surface（subsurface）として共有するクラス
+    背景のような大きな不透明画像は詰め込まずに1枚で1ページにする
+    ページは画面の表示形式の画素データのままキャッシュファイル（アセットパック）に保存し，
+    次回からは画像の読み込み・回転・拡大縮小をせずに画素データを読むだけにする
+    """
+    magic = b"KKAT"
+    version = 2
+    pixel_format = "BGRA"  # 保存する画素の並び（よくある表示形式と同じなら変換がコピーだけになる）
+
+    def __init__(self, assets: Assets, page_size: int = 1024, padding: int = 1):
+        """
+        引数1 assets：画像を取り出し，詰め込んだ部分Surfaceを登録し直すAssets
+        引数2 page_size：ページの幅と高さの上限
+        引数3 padding：画像どうしの間隔（画素）
+        """
+        self.assets = assets
+        self.page_size = page_size
+        self.padding = padding
+        self.pages = []  # ページSurface
+        self.alpha = []  # ページごとの透明度の有無
+        self.entries = {}  # (ファイル名, 加工手順タプル)→(ページ番号, 矩形)
+        self.sig = ""  # キャッシュの判定文字列
+        self.source = ""  # "build"：作った，"cache"：キャッシュから読んだ
+        self.seconds = 0.0  # 作る／読むのにかかった時間
+
+    def signature(self, keys: list, solo: list) -> str:
+        """
+        キャッシュが使えるかを判定する文字列（元画像の大きさと更新時刻，加工手順，画面の表示形式，pygameのバージョン）
+        """
+        files = []
+        for name in sorted({name for name, _ in keys} | set(solo)):
+            st = os.stat(os.path.join(self.assets.directory, name))
+            files.append((name, st.st_size, st.st_mtime_ns))
+        screen = pg.display.get_surface()
+        masks = screen.get_masks() if screen is not None else None
+        return repr((self.version, pg.version.ver, masks, files, keys, solo))
+
+    def layout(self, sizes: list) -> list:
+        """
+        大きさのリストを棚詰め（高い順に左から並べ，あふれたら次の段・次のページ）で配置する
+        戻り値：大きさと同じ順の(ページ番号, x, y)のリストと，ページごとの(幅, 高さ)のリスト
+        """
+        pad = self.padding
+        order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+        # 段の幅は全画像の面積から正方形に近くなるように決める（ページの上限は超えない）
+        area = sum((w + pad)*(h + pad) for w, h in sizes)
+        width = min(self.page_size, max([int(math.sqrt(area)*1.25)] + [w for w, _ in sizes]))
+        places = [None]*len(sizes)
+        pages = [[0, 0]]
+        x = y = shelf = 0
+        for i in order:
+            w, h = sizes[i]
+            if x + w > width:  # 次の段へ
+                x, y, shelf = 0, y + shelf + pad, 0
+            if y + h > self.page_size:  # 次のページへ
+                pages.append([0, 0])
+                x = y = shelf = 0
+            places[i] = (len(pages) - 1, x, y)
+            page = pages[-1]
+            page[0] = max(page[0], x + w)
+            page[1] = max(page[1], y + h)
+            x += w + pad
+            shelf = max(shelf, h)
+        return places, [tuple(page) for page in pages]
+
+    def build(self, keys: list, solo: list):
+        """
+        画像を加工してページに詰め込む
+        引数1 keys：(ファイル名, 加工手順タプル)のリスト
+        引数2 solo：詰め込まずに1枚で1ページにする不透明な画像（背景）のファイル名のリスト．画面の大きさで切り取る
+        """
+        images = [self.assets.get(name, *ops) for name, ops in keys]
+        places, sizes = self.layout([img.get_size() for img in images])
+        self.pages = [pg.Surface(size, pg.SRCALPHA) for size in sizes]
+        self.alpha = [True]*len(sizes)
+        self.entries = {}
+        for key, img, (page, x, y) in zip(keys, images, places):
+            # 透明なページに最大値合成すると，半透明の画素も元の値のまま写る
+            self.pages[page].blit(img, (x, y), special_flags=pg.BLEND_RGBA_MAX)
+            self.entries[key] = (page, pg.Rect((x, y), img.get_size()))
+        screen = pg.display.get_surface()
+        for name in solo:
+            img = self.assets.load(name)
+            if screen is not None:  # 画面からはみ出す部分は描かれないので持たない
+                img = img.subsurface(img.get_rect().clip(screen.get_rect())).copy()
+            self.entries[name, ()] = (len(self.pages), img.get_rect())
+            self.pages.append(img)
+            self.alpha.append(False)
+
+    def install(self):
+        """
+        ページを画面の表示形式に変換し，その部分SurfaceをAssetsに登録する．詰め込んだ画像の加工途中の画像はAssetsから捨てる
+        """
+        if pg.display.get_surface() is not None:
+            self.pages = [page.convert_alpha() if alpha else page.convert()
+                          for page, alpha in zip(self.pages, self.alpha)]
+        derived = self.assets.derived
+        for key in list(derived):
+            name, ops = key
+            if key not in self.entries and any(k[0] == name and k[1][:len(ops)] == ops for k in self.entries):
+                del derived[key]
+        for (name, ops), (page, rect) in self.entries.items():
+            img = self.pages[page].subsurface(rect)
+            if ops:
+                derived[name, ops] = img
+            else:
+                self.assets.images[name] = img
+
+    def save(self, path: str):
+        """
+        ページの画素データと配置をキャッシュファイルに書き出す（一時ファイルに書いてから置き換える）
+        """
+        index = {
+            "signature": self.sig,
+            "pages": [[*page.get_size(), alpha] for page, alpha in zip(self.pages, self.alpha)],
+            "entries": [[repr(key), page, *rect] for key, (page, rect) in self.entries.items()],
+        }
+        head = json.dumps(index).encode("utf-8")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as wf:
+            wf.write(self.magic + bytes([self.version]) + len(head).to_bytes(4, "little") + head)
+            for page in self.pages:
+                wf.write(pg.image.tobytes(page, self.pixel_format))
+        os.replace(tmp, path)
+
+    def load(self, path: str) -> bool:
+        """
+        キャッシュファイルを読み込む
+        戻り値：ファイルがあり，元画像や加工手順が変わっていなければTrue
+        """
+        try:
+            with open(path, "rb") as rf:
+                data = rf.read()
+            if data[:4] != self.magic or data[4] != self.version:
+                return False
+            size = int.from_bytes(data[5:9], "little")
+            index = json.loads(data[9:9 + size].decode("utf-8"))
+            if index["signature"] != self.sig:
+                return False
+            pos = 9 + size
+            view = memoryview(data)
+            pages, alpha = [], []
+            for w, h, has_alpha in index["pages"]:
+                pages.append(pg.image.frombuffer(view[pos:pos + w*h*4], (w, h), self.pixel_format))
+                alpha.append(has_alpha)
+                pos += w*h*4
+            if pos != len(data):
+                return False
+        except (OSError, ValueError, KeyError, IndexError):
+            return False
+        self.pages, self.alpha = pages, alpha
+        self.entries = {ast.literal_eval(key): (page, pg.Rect(x, y, w, h))
+                        for key, page, x, y, w, h in index["entries"]}
+        return True
+
+    def prepare(self, keys: list, solo: list = (), cache: str = None):
+        """
+        キャッシュがあれば読み込み，なければ画像を加工して詰め込んでキャッシュに保存し，Assetsに登録する
+        引数1 keys：(ファイル名, 加工手順タプル)のリスト
+        引数2 solo：詰め込まずに1枚で1ページにする不透明な画像のファイル名のリスト
+        引数3 cache：キャッシュファイル（Noneならキャッシュを使わない）
+        """
+        start = time.perf_counter()
+        keys, solo = list(keys), list(solo)
+        self.sig = self.signature(keys, solo)
+        if cache and self.load(cache):
+            self.source = "cache"
+        else:
+            self.build(keys, solo)
+            self.source = "build"
+            if cache:
+                try:
+                    self.save(cache)
+                except OSError:  # 保存できなくても毎回作り直すだけ
+                    pass
+        self.install()
+        self.seconds = time.perf_counter() - start
+
+    def stats(self) -> dict:
+        """
+        アトラスの統計を辞書で返す
+        """
+        return {
+            "source": self.source,
+            "ms": self.seconds*1000,
+            "pages": [page.get_size() for page in self.pages],
+            "images": len(self.entries),
+            "page_bytes": sum(page.get_width()*page.get_height()*4 for page in self.pages),
+            "image_bytes": sum(rect.width*rect.height*4 for _, rect in self.entries.values()),
+        }
+
+
+atlas = SpriteAtlas(assets)
+
+
+class Renderer:
+    """
+    ゲーム画面の描画を管理するクラス
+    dirtyモードでは前フレームと今フレームに描いた矩形だけを背景で消して更新する
+    fullモードでは毎フレーム背景全体を描き直して画面全体を更新する
+    """
+    def __init__(self, screen: pg.Surface, bg_img: pg.Surface, dirty: bool = True):
+        """
+        引数1 screen：画面Surface
+        引数2 bg_img：背景画像Surface
+        引数3 dirty：差分描画を行うかどうか
+        """
+        self.screen = screen
+        self.bg_img = bg_img
+        self.dirty = dirty
+        self.rects = []  # 今フレームに描いた矩形
+        self.prev_rects = []  # 前フレームに描いた矩形
+        self.full_redraw = True  # 次のフレームで画面全体を描き直すか
+        self.pixels = 0  # 直前のフレームで転送した画素数
+        self.total_pixels = 0
+        self.frames = 0
+
+    def begin(self):
+        """
+        フレームの描画を開始し，前フレームの描画内容を背景で消す
+        """
+        self.rects = []
+        if not self.dirty or self.full_redraw:
+            self.screen.blit(self.bg_img, [0, 0])
+        else:
+            for rect in self.prev_rects:
+                self.screen.blit(self.bg_img, rect, rect)
+
+    def blit(self, source: pg.Surface, dest, area=None, special_flags=0) -> pg.Rect:
+        """
+        Surface.blitと同じ引数で描画し，描いた矩形を記録する
+        """
+        rect = self.screen.blit(source, dest, area, special_flags)
+        self.rects.append(rect)
+        return rect
+
+    def blits(self, blit_sequence: list):
+        """
+        (Surface, 位置)のリストをまとめて描画し，描いた矩形を記録する
+        """
+        self.rects.extend(self.screen.blits(blit_sequence))
+
+    def draw(self, group: pg.sprite.AbstractGroup):
+        """
+        スプライトグループを描画し，描いた矩形を記録する
+        """
+        if isinstance(group, (ProjectileGroup, ParticleSystem)):
+            self.rects.extend(self.screen.blits(group.blit_sequence()))
+        else:
+            self.rects.extend(self.screen.blits([(spr.image, spr.rect) for spr in group]))
+
+    def mark(self, rect: pg.Rect):
+        """
+        直接描画した矩形を更新対象として記録する
+        """
+        self.rects.append(pg.Rect(rect))
+
+    def flip(self):
+        """
+        描画した内容を画面に反映する
+        """
+        if not self.dirty or self.full_redraw:
+            pg.display.update()
+            self.pixels = WIDTH*HEIGHT
+            self.full_redraw = False
+        else:
+            area = self.screen.get_rect()
+            update_rects = [r.clip(area) for r in self.prev_rects + self.rects]
+            pg.display.update(update_rects)
+            self.pixels = sum(r.width*r.height for r in update_rects)
+        self.prev_rects = self.rects
+        self.total_pixels += self.pixels
+        self.frames += 1
+
+    def stats(self) -> dict:
+        """
+        描画の統計を辞書で返す
+        """
+        return {
+            "mode": "dirty" if self.dirty else "full",
+            "frames": self.frames,
+            "last_pixels": self.pixels,
+            "avg_pixels": self.total_pixels/self.frames if self.frames else 0,
+        }
+
+
+class RectCollider:
+    """
+    ビーム・爆弾・敵機・ボスの衝突判定をRect.collidelistallでまとめて行うクラス
+    当たる側と当たる相手のうち数の少ない方だけをPythonで回し，多い方の矩形のリストは
+    collidelistall（C実装）で1回ずつ調べる
+    重なりはpg.sprite.groupcollide／spritecollideと同じ並び順で返す
+    """
+    def __init__(self):
+        self.lists = {}  # グループ→(スプライトのリスト, 矩形のリスト)（contacts用，finishで捨てる）
+
+    def listed(self, group: pg.sprite.AbstractGroup) -> tuple[list, list]:
+        """
+        グループの(スプライトのリスト, 矩形のリスト)を返す（1フレームにグループごとに1回だけ作る）
+        """
+        item = self.lists.get(group)
+        if item is None:
+            sprites = group.sprites()
+            item = self.lists[group] = (sprites, [spr.rect for spr in sprites])
+        return item
+
+    def spritecollide(self, sprite: pg.sprite.Sprite, group: pg.sprite.AbstractGroup, dokill: bool) -> list:
+        """
+        pg.sprite.spritecollideと同じく，spriteに衝突したgroupのスプライトのリストを返す
+        """
+        sprites = group.sprites()
+        crashed = [sprites[i] for i in sprite.rect.collidelistall([spr.rect for spr in sprites])]
+        if dokill:
+            for spr in crashed:
+                spr.kill()
+        return crashed
+
+    def overlaps(self, spritesa: list, rectsa: list, spritesb: list, rectsb: list) -> list:
+        """
+        重なっている(spritesaのスプライト, 重なったspritesbのスプライトのリスト)を，
+        spritesaの並び順（リストの中はspritesbの並び順）で返す
+        引数1～4 spritesa, rectsa, spritesb, rectsb：スプライトのリストとその矩形のリスト
+        """
+        if not spritesa or not spritesb:
+            return []
+        result = []
+        if len(spritesa) <= len(spritesb):
+            for spra, recta in zip(spritesa, rectsa):
+                crashed = [spritesb[i] for i in recta.collidelistall(rectsb)]
+                if crashed:
+                    result.append((spra, crashed))
+        else:
+            found = {}  # spritesaの番号→重なったspritesbのスプライトのリスト
+            for sprb, rectb in zip(spritesb, rectsb):
+                for i in rectb.collidelistall(rectsa):
+                    found.setdefault(i, []).append(sprb)
+            result = [(spritesa[i], found[i]) for i in sorted(found)]
+        return result
+
+    def contacts(self, pairs: list) -> list:
+        """
+        (当たる側のグループ, 弾のグループ)の組ごとに，重なっている(当たる側, 弾のリスト)のリストを返す
+        調べるのは組に挙げたグループどうしだけで，グループのスプライトと矩形のリストは組の間で使い回す
+        並び順はgroupcollideと同じ（当たる側も弾もグループ内の並び順）．消すのは呼び出し側で行う
+        """
+        return [self.overlaps(*self.listed(groupa), *self.listed(groupb)) for groupa, groupb in pairs]
+
+    def alive(self, group: pg.sprite.AbstractGroup, ref: pg.sprite.Sprite) -> bool:
+        """
+        contactsで返したスプライトがまだグループにいるかを返す
+        """
+        return group.has(ref)
+
+    def kill(self, group: pg.sprite.AbstractGroup, ref: pg.sprite.Sprite):
+        """
+        contactsで返したスプライトを消す
+        """
+        ref.kill()
+
+    def sprite(self, group: pg.sprite.AbstractGroup, ref: pg.sprite.Sprite) -> pg.sprite.Sprite:
+        """
+        contactsで返したものをスプライトにする（RectColliderではそのまま）
+        """
+        return ref
+
+    def finish(self):
+        """
+        衝突判定の最後に呼び，このフレームのスプライトと矩形のリストを捨てる（killしたものはすぐに消えている）
+        """
+        self.lists = {}
+
+
+class ComboMatcher:
+    """
+    隠しコマンド（キーの並び）をまとめて照合するオートマトン
+    すべてのコマンドのトライに失敗時の戻り先を付け，状態ごとの「キー→次の状態」の表に展開しておくので，
+    キーが1回押されるごとに表を1回引くだけで照合できる
+    途中で違うキーを押したときは，そこまでの入力の続きとして一致するところからやり直す
+    どのコマンドにも含まれないキーは無視し，前のキーからtimeout tickより空いたら最初に戻る
+    （押した時刻はInputBufferのリングバッファが持ち，空いたtick数を渡してもらう）
+    """
+    def __init__(self, combos: dict, timeout: int = TIMEOUT):
+        """
+        引数1 combos：コマンド名→キー定数の並びの辞書
+        引数2 timeout：入力途中のコマンドをリセットするまでのtick数
+        """
+        self.timeout = timeout
+        goto = [{}]  # トライ：状態→{キー: 次の状態}
+        names = [None]  # 状態→そこで完成するコマンド名
+        for name, keys in combos.items():
+            state = 0
+            for key in keys:
+                if key not in goto[state]:
+                    goto[state][key] = len(goto)
+                    goto.append({})
+                    names.append(None)
+                state = goto[state][key]
+            names[state] = name
+        alphabet = {key for keys in combos.values() for key in keys}
+        self.alphabet = alphabet  # どれかのコマンドに使うキーの集合
+        table = [{} for _ in goto]
+        fail = [0]*len(goto)
+        pending = collections.deque()
+        for key in alphabet:
+            table[0][key] = goto[0].get(key, 0)
+            if table[0][key]:
+                pending.append(table[0][key])
+        while pending:  # 浅い状態から順に戻り先と表を埋める
+            state = pending.popleft()
+            if names[state] is None:
+                names[state] = names[fail[state]]
+            for key in alphabet:
+                nxt = goto[state].get(key)
+                if nxt is None:
+                    table[state][key] = table[fail[state]][key]
+                else:
+                    fail[nxt] = table[fail[state]][key]
+                    table[state][key] = nxt
+                    pending.append(nxt)
+        self.table = table
+        self.names = names
+        self.state = 0  # 現在の状態（0：何も入力していない）
+
+    def feed(self, key: int, gap: int = 0) -> Union[str, None]:
+        """
+        押されたキーを1つ進める
+        引数1 key：押されたキー定数
+        引数2 gap：コマンドに使うキーを前に押してからのtick数（timeoutより大きければ最初から）
+        戻り値：コマンドが完成したらその名前，それ以外はNone
+        """
+        nxt = self.table[self.state if gap <= self.timeout else 0].get(key)
+        if nxt is None:  # どのコマンドにも使わないキー
+            return None
+        name = self.names[nxt]
+        self.state = 0 if name is not None else nxt  # 完成したら最初から
+        return name
+
+
+class InputBuffer:
+    """
+    tickごとのKEYDOWNイベントを操作名の並びに変えるクラス
+    キーの割り当て（キー→操作名）と隠しコマンドの照合をここで行い，ゲームには操作名の並びだけを渡す
+    隠しコマンドに使うキーは押されたtickと一緒にリングバッファへためておき，
+    前の押下からの間隔で照合の途中をやり直すかを決める
+    """
+    def __init__(self, bindings: dict, combos: dict):
+        """
+        引数1 bindings：キー定数→操作名の辞書
+        引数2 combos：隠しコマンド名→キー定数の並びの辞書（完成したらコマンド名を操作名として返す）
+        """
+        self.bindings = bindings
+        self.matcher = ComboMatcher(combos)
+        # (tick, キー定数)：いちばん長いコマンドの分だけ残す
+        self.presses = collections.deque(maxlen=max(map(len, combos.values()), default=1))
+
+    def feed(self, tick: int, events: list) -> list[str]:
+        """
+        1tick分のイベントを取り込み，押された順に操作名のリストを返す
+        引数1 tick：現在のtick
+        引数2 events：このtickで処理するイベントのリスト
+        """
+        actions = []
+        for event in events:
+            if event.type != pg.KEYDOWN:
+                continue
+            action = self.bindings.get(event.key)
+            if action is not None:
+                actions.append(action)
+            if event.key in self.matcher.alphabet:
+                gap = tick - self.presses[-1][0] if self.presses else 0
+                self.presses.append((tick, event.key))
+                combo = self.matcher.feed(event.key, gap)
+                if combo is not None:
+                    actions.append(combo)
+        return actions
+
+
+class Projectile:
+    """
+    ProjectileGroupの弾1つ分の写し（描画位置・爆発位置・衝突結果に使う）
+    """
+    __slots__ = ("image", "rect")
+
+    def __init__(self, image: pg.Surface, rect: pg.Rect):
+        self.image = image
+        self.rect = rect
+
+
+class ProjectileGroup:
+    """
+    ビームや爆弾を1グループ分まとめてNumPy配列（位置・大きさ・1tickの移動量・画像番号）で持つクラス
+    pg.sprite.Groupと同じようにadd／update／len／反復ができ，
+    移動・画面外の削除・衝突判定を配列演算でまとめて行う
+    配列の並びは追加順で，pg.sprite.Groupの並び順と同じになる
+    """
+    X, Y, W, H, DX, DY, PX, PY, IMG = range(9)  # 配列の列（PX, PYは直前のtickで移動する前の位置）
+
+    def __init__(self, capacity: int = 256):
+        """
+        引数 capacity：最初に確保する弾の数（足りなくなったら倍にする）
+        """
+        self.data = np.zeros((capacity, 9), np.int32)
+        self.n = 0  # 今ある弾の数
+        self.images = []  # 画像番号→Surface
+        self.image_ids = {}  # Surface→画像番号
+
+    def add(self, *sprites: pg.sprite.Sprite):
+        """
+        生成したビーム・爆弾スプライトの位置と速度を配列に写す
+        写したスプライトはプールに戻す
+        """
+        for spr in sprites:
+            if self.n == len(self.data):
+                self.data = np.concatenate([self.data, np.zeros_like(self.data)])
+            img = self.image_ids.get(spr.image)
+            if img is None:
+                img = self.image_ids[spr.image] = len(self.images)
+                self.images.append(spr.image)
+            rect = spr.rect
+            # move_ipは毎回小数を切り捨てるので，1tickの移動量は整数で決まる
+            dx, dy = int(spr.speed*spr.vx), int(spr.speed*spr.vy)
+            self.data[self.n] = (rect.x, rect.y, rect.width, rect.height, dx, dy, rect.x, rect.y, img)
+            self.n += 1
+            if isinstance(spr, PooledSprite) and spr.pool is not None:
+                spr.pool.release(spr)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __iter__(self):
+        return iter(self.sprites())
+
+    def sprite_at(self, i: int) -> Projectile:
+        """
+        i番目の弾の写しを返す
+        """
+        x, y, w, h = self.data[i, :4].tolist()
+        return Projectile(self.images[self.data[i, self.IMG]], pg.Rect(x, y, w, h))
+
+    def sprites(self) -> list:
+        """
+        すべての弾の写しのリストを返す
+        """
+        return [self.sprite_at(i) for i in range(self.n)]
+
+    def rects(self) -> "np.ndarray":
+        """
+        すべての弾の(left, top, width, height)の配列を返す
+        """
+        return self.data[:self.n, :4]
+
+    def keep(self, mask: "np.ndarray"):
+        """
+        maskがTrueの弾だけを並び順のまま残す
+        """
+        kept = self.data[:self.n][mask]
+        self.n = len(kept)
+        self.data[:self.n] = kept
+
+    def update(self):
+        """
+        すべての弾を1tick分移動させ，画面からはみ出したものを取り除く（check_boundと同じ判定）
+        """
+        d = self.data[:self.n]
+        d[:, self.PX] = d[:, self.X]
+        d[:, self.PY] = d[:, self.Y]
+        d[:, self.X] += d[:, self.DX]
+        d[:, self.Y] += d[:, self.DY]
+        x, y = d[:, self.X], d[:, self.Y]
+        inside = (x >= 0) & (x + d[:, self.W] <= WIDTH) & (y >= 0) & (y + d[:, self.H] <= HEIGHT)
+        if not inside.all():
+            self.keep(inside)
+
+    def overlap(self, rects: "np.ndarray") -> "np.ndarray":
+        """
+        矩形の配列（T×4）とすべての弾の重なり（colliderectと同じ判定）をT×弾数の真理値行列で返す
+        """
+        d = self.data[:self.n]
+        left, top = d[:, self.X], d[:, self.Y]
+        right, bottom = left + d[:, self.W], top + d[:, self.H]
+        tl, tt = rects[:, 0:1], rects[:, 1:2]
+        tr, tb = tl + rects[:, 2:3], tt + rects[:, 3:4]
+        return (tl < right) & (left < tr) & (tt < bottom) & (top < tb)
+
+    def blit_sequence(self, alpha: float = None) -> list:
+        """
+        Surface.blits用の(Surface, 位置)のリストを返す
+        引数 alpha：直前のtickから次のtickまでの経過割合（Noneなら今の位置）
+        """
+        d = self.data[:self.n]
+        x, y = d[:, self.X], d[:, self.Y]
+        if alpha is not None:
+            px, py = d[:, self.PX], d[:, self.PY]
+            x = px + np.round((x - px)*alpha).astype(np.int32)
+            y = py + np.round((y - py)*alpha).astype(np.int32)
+        images = self.images
+        return [(images[i], (xi, yi)) for i, xi, yi in zip(d[:, self.IMG].tolist(), x.tolist(), y.tolist())]
+
+
+class ArrayCollider:
+    """
+    ProjectileGroupを相手にする衝突判定を配列演算で行うクラス
+    RectColliderと同じ使い方で，重なりはpg.sprite.groupcollide／spritecollideと同じ並び順で返す
+    """
+    def __init__(self):
+        self.masks = {}  # ProjectileGroup→残す弾の真理値配列（contactsのあと，finishで反映する）
+
+    def contacts(self, pairs: list) -> list:
+        """
+        (当たる側のグループ, 弾のグループ)の組ごとに，重なっている(当たる側, 弾のリスト)のリストを返す
+        ProjectileGroupの弾は配列の番号で返す（消されるまで番号は変わらない）
+        """
+        result = []
+        for groupa, groupb in pairs:
+            hits = []
+            result.append(hits)
+            if not len(groupa) or not len(groupb):
+                continue
+            if isinstance(groupa, ProjectileGroup):
+                sprites = None
+                rects = groupa.rects()
+            else:
+                sprites = groupa.sprites()
+                rects = np.array([(spr.rect.x, spr.rect.y, spr.rect.width, spr.rect.height) for spr in sprites])
+            hit = groupb.overlap(rects)
+            for i in np.flatnonzero(hit.any(axis=1)).tolist():
+                hits.append((sprites[i] if sprites is not None else i, np.flatnonzero(hit[i]).tolist()))
+        return result
+
+    def alive(self, group, ref) -> bool:
+        """
+        contactsで返したスプライト・弾がまだ消されていないかを返す
+        """
+        if isinstance(group, ProjectileGroup):
+            mask = self.masks.get(group)
+            return mask is None or bool(mask[ref])
+        return group.has(ref)
+
+    def kill(self, group, ref):
+        """
+        contactsで返したスプライト・弾を消す（ProjectileGroupの弾はfinishでまとめて消す）
+        """
+        if isinstance(group, ProjectileGroup):
+            mask = self.masks.get(group)
+            if mask is None:
+                mask = self.masks[group] = np.ones(len(group), bool)
+            mask[ref] = False
+        else:
+            ref.kill()
+
+    def sprite(self, group, ref):
+        """
+        contactsで返したものをスプライト（ProjectileGroupの弾はProjectile）にする
+        """
+        return group.sprite_at(ref) if isinstance(group, ProjectileGroup) else ref
+
+    def finish(self):
+        """
+        killした弾をProjectileGroupから取り除く
+        """
+        for group, mask in self.masks.items():
+            group.keep(mask)
+        self.masks = {}
+
+    def spritecollide(self, sprite: pg.sprite.Sprite, group: ProjectileGroup, dokill: bool) -> list:
+        """
+        pg.sprite.spritecollideと同じく，spriteに衝突した弾のリストを返す
+        """
+        if not len(group):
+            return []
+        rect = sprite.rect
+        hit = group.overlap(np.array([(rect.x, rect.y, rect.width, rect.height)]))[0]
+        cols = np.flatnonzero(hit)
+        crashed = [group.sprite_at(j) for j in cols.tolist()]
+        if dokill and crashed:
+            group.keep(~hit)
+        return crashed
+
+
+class SpritePool:
+    """
+    使い終わった（kill()された）スプライトを取っておき，次の生成で再利用するクラス
+    """
+    def __init__(self, cls: type, size: int = 256):
+        """
+        引数1 cls：プールするスプライトのクラス
+        引数2 size：取っておくスプライトの最大数
+        """
+        self.cls = cls
+        self.size = size
+        self.free = []  # 再利用を待つスプライト
+        self.created = 0  # 新しく生成した数
+        self.reused = 0  # 再利用した数
+        self.released = 0  # プールに戻った数
+        self.discarded = 0  # プールが満杯で捨てた数
+
+    def acquire(self, *args, **kwargs) -> pg.sprite.Sprite:
+        """
+        プールからスプライトを取り出して初期化し直す（空なら新しく生成する）
+        """
+        if self.free:
+            obj = self.free.pop()
+            obj.__init__(*args, **kwargs)
+            self.reused += 1
+        else:
+            obj = self.cls(*args, **kwargs)
+            self.created += 1
+        return obj
+
+    def release(self, obj: pg.sprite.Sprite):
+        """
+        kill()されたスプライトをプールに戻す
+        """
+        if len(self.free) < self.size:
+            self.free.append(obj)
+            self.released += 1
+        else:
+            self.discarded += 1
+
+    def stats(self) -> dict:
+        """
+        プールの統計を辞書で返す
+        """
+        return {
+            "size": self.size,
+            "free": len(self.free),
+            "created": self.created,
+            "reused": self.reused,
+            "released": self.released,
+            "discarded": self.discarded,
+        }
+
+
+class PooledSprite(pg.sprite.Sprite):
+    """
+    SpritePoolで再利用できるスプライトの基底クラス
+    new()で生成し，kill()されると自動でプールに戻る
+    """
+    pool = None  # クラスごとのSpritePool（Noneならプールしない）
+
+    @classmethod
+    def new(cls, *args, **kwargs) -> "PooledSprite":
+        """
+        プールから取り出す（プールがなければ普通に生成する）
+        """
+        if cls.pool is None:
+            return cls(*args, **kwargs)
+        return cls.pool.acquire(*args, **kwargs)
+
+    def kill(self):
+        """
+        すべてのグループから取り除き，プールに戻す
+        """
+        alive = self.alive()
+        super().kill()
+        if alive and self.pool is not None:
+            self.pool.release(self)
+
+
 class Bird(pg.sprite.Sprite):
     """
     ゲームキャラクター（こうかとん）に関するクラス
@@ -117,6 +955,26 @@ class Bird(pg.sprite.Sprite):
         pg.K_RIGHT: (+1, 0),
     }
 
+    @staticmethod
+    def image_keys(num: int) -> dict:
+        """
+        向き→(ファイル名, 加工手順タプル)の辞書を返す
+        引数 num：こうかとん画像ファイル名の番号
+        """
+        name = f"{num}.png"
+        zoom = ("rotozoom", 0, 0.8)
+        flip = ("flip", True, False)  # デフォルトのこうかとん
+        return {
+            (+1, 0): (name, (zoom, flip)),  # 右
+            (+1, -1): (name, (zoom, flip, ("rotozoom", 45, 1.0))),  # 右上
+            (0, -1): (name, (zoom, flip, ("rotozoom", 90, 1.0))),  # 上
+            (-1, -1): (name, (zoom, ("rotozoom", -45, 1.0))),  # 左上
+            (-1, 0): (name, (zoom,)),  # 左
+            (-1, +1): (name, (zoom, ("rotozoom", 45, 1.0))),  # 左下
+            (0, +1): (name, (zoom, flip, ("rotozoom", -90, 1.0))),  # 下
+            (+1, +1): (name, (zoom, flip, ("rotozoom", -45, 1.0))),  # 右下
+        }
+
     def __init__(self, num: int, xy: tuple[int, int]):
         """
         こうかとん画像Surfaceを生成する
@@ -124,18 +982,7 @@ class Bird(pg.sprite.Sprite):
         引数2 xy：こうかとん画像の位置座標タプル
         """
         super().__init__()
-        img0 = pg.transform.rotozoom(pg.image.load(f"fig/{num}.png"), 0, 0.8)
-        img = pg.transform.flip(img0, True, False)  # デフォルトのこうかとん
-        self.imgs = {
-            (+1, 0): img,  # 右
-            (+1, -1): pg.transform.rotozoom(img, 45, 1.0),  # 右上
-            (0, -1): pg.transform.rotozoom(img, 90, 1.0),  # 上
-            (-1, -1): pg.transform.rotozoom(img0, -45, 1.0),  # 左上
-            (-1, 0): img0,  # 左
-            (-1, +1): pg.transform.rotozoom(img0, 45, 1.0),  # 左下
-            (0, +1): pg.transform.rotozoom(img, -90, 1.0),  # 下
-            (+1, +1): pg.transform.rotozoom(img, -45, 1.0),  # 右下
-        }
+        self.imgs = {dire: assets.get(name, *ops) for dire, (name, ops) in __class__.image_keys(num).items()}
         self.dire = (+1, 0)
         self.image = self.imgs[self.dire]
         self.rect = self.image.get_rect()
@@ -143,30 +990,36 @@ class Bird(pg.sprite.Sprite):
         self.speed = 10
         self.state = "nomal"
         self.hyper_life = 0
+        self.command = False  # 隠しコマンドが成功して上下にも動けるか
 
-    def change_img(self, num: int, screen: pg.Surface):
+    def change_img(self, num: int):
         """
-        こうかとん画像を切り替え，画面に転送する
-        引数1 num：こうかとん画像ファイル名の番号
-        引数2 screen：画面Surface
+        こうかとん画像を切り替える（画面への転送は描画のときに行う）
+        引数 num：こうかとん画像ファイル名の番号
         """
-        self.image = pg.transform.rotozoom(pg.image.load(f"fig/{num}.png"), 0, 0.8)
-        screen.blit(self.image, self.rect)
+        self.image = assets.get(f"{num}.png", ("rotozoom", 0, 0.8))
 
     def update(self, key_lst: list[bool], screen: pg.Surface):
-        global command1
         """
-        押下キーに応じてこうかとんを移動させる
+        押下キーに応じてこうかとんを移動させ，画面に転送する
         引数1 key_lst：押下キーの真理値リスト
         引数2 screen：画面Surface
         """
+        self.move(key_lst)
+        screen.blit(self.image, self.rect)
+
+    def move(self, key_lst: list[bool]):
+        """
+        押下キーに応じてこうかとんを移動させる
+        引数 key_lst：押下キーの真理値リスト
+        """
         sum_mv = [0, 0]
-        if command1 == False:
+        if self.command == False:
             for k, mv in __class__.delta.items():
                 if key_lst[k]:
                     sum_mv[0] += mv[0]
                     sum_mv[1] += mv[1]
-        if command1 == True:
+        if self.command == True:
             for k, mv in __class__.command_mode.items():
                 if key_lst[k]:
                     sum_mv[0] += mv[0]
@@ -177,14 +1030,13 @@ class Bird(pg.sprite.Sprite):
         if not (sum_mv[0] == 0 and sum_mv[1] == 0):
             self.dire = tuple(sum_mv)
             self.image = self.imgs[self.dire]
-        screen.blit(self.image, self.rect)
         
 
-class Beam(pg.sprite.Sprite):
+class Beam(PooledSprite):
     """
     ビームに関するクラス
     """
-    cooltime = 0
+    cooltime = 20  # 次のビームを撃てるまでのtick数
 
     def __init__(self, bird: Bird):
         """
@@ -194,14 +1046,13 @@ class Beam(pg.sprite.Sprite):
         super().__init__()
         self.vx, self.vy = (0, -1)
         angle = math.degrees(math.atan2(-self.vy, self.vx))
-        self.image = pg.transform.rotozoom(pg.image.load(f"fig/beam.png"), angle, 0.8)
+        self.image = assets.get("beam.png", ("rotozoom", angle, 0.8))
         self.vx = math.cos(math.radians(angle))
         self.vy = -math.sin(math.radians(angle))
         self.rect = self.image.get_rect()
         self.rect.centery = bird.rect.centery+bird.rect.height*self.vy
         self.rect.centerx = bird.rect.centerx+bird.rect.width*self.vx
         self.speed = 10
-        Beam.cooltime = 20
 
     def update(self):
         """
@@ -211,49 +1062,96 @@ class Beam(pg.sprite.Sprite):
         self.rect.move_ip(self.speed*self.vx, self.speed*self.vy)
         if check_bound(self.rect) != (True, True):
             self.kill()
-    
-    @classmethod
-    def cooltime_update(cls):
-        """
-        ビームのクールタイムを減らす
-        """
-        if cls.cooltime > 0:
-            cls.cooltime -= 1
 
 
 class Enemy(pg.sprite.Sprite):
     """
     敵機に関するクラス
     """
-    imgs = [pg.transform.rotozoom(pg.image.load(f"fig/alien{i}.png"), 0, 0.5) for i in range(1, 4)]
+    image_keys = [(f"alien{i}.png", (("rotozoom", 0, 0.5),)) for i in range(1, 4)]  # (ファイル名, 加工手順タプル)
+    imgs = []  # 画面を作ってから最初の敵機を作るときに読み込む
+    interval_range = (50, 300)  # 爆弾投下インターバルの範囲（tick）
+
+    @classmethod
+    def load_images(cls):
+        """
+        敵機の画像を読み込む（画面を作った後に呼ぶと表示形式に変換された画像になる）
+        """
+        cls.imgs = [assets.get(name, *ops) for name, ops in cls.image_keys]
     
     def __init__(self):
         super().__init__()
+        if not __class__.imgs:
+            __class__.load_images()
         self.image = random.choice(__class__.imgs)
         self.rect = self.image.get_rect()
         self.rect.center = random.randint(10, WIDTH-10), 0
         self.vx, self.vy = 0, +6
         self.bound = random.randint(50, HEIGHT//2)  # 停止位置
-        self.state = "down"  # 降下状態or停止状態
-        self.interval = random.randint(50, 300)  # 爆弾投下インターバル
+        self.state = "down"  # 降下状態or停止状態or退場状態
+        self.interval = random.randint(*__class__.interval_range)  # 爆弾投下インターバル
+        self.hp = 1  # 倒すのに必要な命中数（合体すると増える）
+        self.on_stop = None  # 停止状態になったときに呼ぶ関数（爆弾投下の予約）
+
+    def hit(self, damage: int = 1) -> bool:
+        """
+        ビームが当たったときの処理：体力をdamage減らす
+        戻り値：倒されたらTrue（合体して体力が残っていればFalse）
+        """
+        self.hp -= damage
+        return self.hp <= 0
+
+    def leave(self):
+        """
+        爆弾の投下をやめて画面の上へ退場させる
+        """
+        self.state = "leave"
+        self.vy = -6
 
     def update(self):
         """
         敵機を速度ベクトルself.vyに基づき移動（降下）させる
         ランダムに決めた停止位置_boundまで降下したら，_stateを停止状態に変更する
+        退場状態なら上へ移動し，画面外に出たら取り除く
         引数 screen：画面Surface
         """
+        if self.state == "leave":
+            self.rect.move_ip(self.vx, self.vy)
+            if self.rect.bottom < 0:
+                self.kill()
+            return
         if self.rect.centery > self.bound:
             self.vy = 0
-            self.state = "stop"
+            if self.state != "stop":
+                self.state = "stop"
+                if self.on_stop is not None:
+                    self.on_stop(self)
         self.rect.move_ip(self.vx, self.vy)
         
 
-class Bomb(pg.sprite.Sprite):
+class Bomb(PooledSprite):
     """
     爆弾に関するクラス
     """
     colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255), (0, 255, 255)]
+    radii = [10, 30]  # 敵機の爆弾とボスの爆弾の半径
+    atlas = {}  # (色, 半径)→爆弾円Surface
+
+    @classmethod
+    def build_atlas(cls):
+        """
+        すべての色と半径の爆弾円Surfaceを作っておく
+        画面が作成済みなら表示形式に変換する
+        """
+        cls.atlas = {}
+        for rad in cls.radii:
+            for color in cls.colors:
+                image = pg.Surface((2*rad, 2*rad))
+                pg.draw.circle(image, color, (rad, rad), rad)
+                if pg.display.get_surface() is not None:
+                    image = image.convert()
+                image.set_colorkey((0, 0, 0), pg.RLEACCEL)
+                cls.atlas[color, rad] = image
 
     def __init__(self, emy: "Enemy",boss: "Boss", bird: Bird):
         """
@@ -264,19 +1162,16 @@ class Bomb(pg.sprite.Sprite):
         """
         super().__init__()
         rad = 10  # 爆弾円の半径：10
-        self.image = pg.Surface((2*rad, 2*rad))
         color = random.choice(__class__.colors)  # 爆弾円の色：クラス変数からランダム選択
-        pg.draw.circle(self.image, color, (rad, rad), rad)
-        self.image.set_colorkey((0, 0, 0))
+        if boss:
+            rad = 30  # ボスの爆弾円の半径：30
+            color = random.choice(__class__.colors)  # ボスの爆弾は色を選び直す
+        if not __class__.atlas:
+            __class__.build_atlas()
+        self.image = __class__.atlas[color, rad]  # 全爆弾で共有するSurface
         self.rect = self.image.get_rect()
         # 爆弾を投下するbossから見た攻撃対象のbirdの方向を計算
         if boss:
-            brad = 30
-            self.image = pg.Surface((2*brad, 2*brad))
-            color = random.choice(__class__.colors)  # 爆弾円の色：クラス変数からランダム選択
-            pg.draw.circle(self.image, color, (brad, brad), brad)
-            self.image.set_colorkey((0, 0, 0))
-            self.rect = self.image.get_rect()
             self.vx, self.vy = calc_orientation(boss.rect, bird.rect)  
             self.rect.centerx = boss.rect.centerx
             self.rect.centery = boss.rect.centery+boss.rect.height//2
@@ -298,7 +1193,7 @@ class Bomb(pg.sprite.Sprite):
             self.kill()
         
 
-class Explosion(pg.sprite.Sprite):
+class Explosion(PooledSprite):
     """
     爆発に関するクラス
     """
@@ -309,8 +1204,7 @@ class Explosion(pg.sprite.Sprite):
         引数2 life：爆発時間
         """
         super().__init__()
-        img = pg.image.load(f"fig/explosion.gif")
-        self.imgs = [img, pg.transform.flip(img, 1, 1)]
+        self.imgs = [assets.get("explosion.gif"), assets.get("explosion.gif", ("flip", 1, 1))]
         self.image = self.imgs[0]
         self.rect = self.image.get_rect(center=obj.rect.center)
         self.life = life
@@ -326,49 +1220,256 @@ class Explosion(pg.sprite.Sprite):
             self.kill()
 
 
-class Score():
+class ParticleSystem:
     """
-    打ち落とした爆弾，敵機の数をスコアとして表示するクラス
-    爆弾：1点
-    敵機：10点
+    爆発の炎と飛び散る火花をまとめてNumPy配列（位置・速度・経過tick・寿命・種類）で持つクラス
+    すべての粒子を1tickごとに配列演算でまとめて動かし，経過tickに応じたコマを共有のコマ列から選んで
+    Surface.blitsで描画する（Explosionの代わりに使う．pg.sprite.Groupと同じようにupdate／lenができる）
+    火花の向きや速さはゲームの乱数列とは別の乱数で決めるので，ゲームの進行は変わらない
     """
-    def __init__(self):
-        self.font = pg.font.Font(None, 50)
-        self.color = (0, 0, 255)
-        self.value = 0
-        self.image = self.font.render(f"Score: {self.value}", 0, self.color)
-        self.rect = self.image.get_rect()
-        self.rect.center = 100, 50
-
-    def update(self, screen: pg.Surface):
-        self.image = self.font.render(f"Score: {self.value}", 0, self.color)
-        screen.blit(self.image, self.rect)
+    X, Y, VX, VY, AY, AGE, LIFE, KIND, PX, PY = range(10)  # 配列の列（PX, PYは直前のtickの位置）
+    FLAME, SPARK = range(2)  # 粒子の種類
+    flame_sizes = [45, 68, 90, 104, 112, 112, 99, 81]  # 炎のコマごとの一辺の長さ（寿命の間に順に進む．元画像は90）
+    spark_colors = [(255, 240, 150), (255, 220, 90), (255, 170, 40), (240, 110, 20), (200, 60, 20), (150, 30, 10)]
+    gravity = 0.25  # 火花に掛かる下向きの加速度（1tickあたり）
+    colorkey = (255, 0, 255)  # 炎のコマの透明色（爆発画像に使われていない色）
+    frames = []  # コマ番号→Surface（炎のコマのあとに火花のコマが並ぶ）
+    start = count = half = None  # 種類→最初のコマ番号，種類→コマ数，コマ番号→(幅/2, 高さ/2)
 
+    @classmethod
+    def frame_keys(cls) -> list:
+        """
+        炎のコマの(ファイル名, 加工手順タプル)のリストを返す（1コマおきに反転して揺らめかせる）
+        透明か不透明かだけの画像なので，補間しないscaleで拡大縮小して半透明の画素を作らない
+        """
+        return [("explosion.gif", (("scale", (size, size)),) + ((("flip", 1, 1),) if i % 2 else ()))
+                for i, size in enumerate(cls.flame_sizes)]
 
-class Lv():
+    @classmethod
+    def load_frames(cls):
+        """
+        炎と火花のコマ列を作っておく（炎はアトラスから，火花は小さくなっていく円を描いて作る）
+        画面が作成済みなら表示形式に変換し，透明色とRLEで描画する（画素ごとのアルファより速く描ける）
+        """
+        frames = []
+        for name, ops in cls.frame_keys():
+            src = assets.get(name, *ops)
+            image = pg.Surface(src.get_size())
+            image.fill(cls.colorkey)
+            image.blit(src, (0, 0))
+            if pg.display.get_surface() is not None:
+                image = image.convert()
+            image.set_colorkey(cls.colorkey, pg.RLEACCEL)
+            frames.append(image)
+        for i, color in enumerate(cls.spark_colors):
+            rad = max(1, 4 - i*3//len(cls.spark_colors))
+            image = pg.Surface((2*rad, 2*rad))
+            pg.draw.circle(image, color, (rad, rad), rad)
+            if pg.display.get_surface() is not None:
+                image = image.convert()
+            image.set_colorkey((0, 0, 0), pg.RLEACCEL)
+            frames.append(image)
+        cls.frames = frames
+        cls.start = np.array([0, len(cls.flame_sizes)])
+        cls.count = np.array([len(cls.flame_sizes), len(cls.spark_colors)])
+        cls.half = np.array([img.get_size() for img in frames], np.float32)/2
+
+    def __init__(self, capacity: int = 256, seed: int = 0):
+        """
+        引数1 capacity：最初に確保する粒子の数（足りなくなったら倍にする）
+        引数2 seed：火花の乱数シード
+        """
+        if not __class__.frames:
+            __class__.load_frames()
+        self.data = np.zeros((capacity, 10), np.float32)
+        self.n = 0  # 今ある粒子の数
+        self.flames = 0  # 今ある炎の数（爆発の数）
+        self.rng = np.random.default_rng(seed)
+
+    def explode(self, center: tuple[int, int], life: int, sparks: float = 1.0):
+        """
+        炎1つと，寿命に応じた数の火花を出す
+        引数1 center：爆発の中心座標
+        引数2 life：炎の寿命（tick）
+        引数3 sparks：火花の数に掛ける倍率
+        """
+        sparks = round((4 + life//20)*sparks)
+        add = np.zeros((1 + sparks, 10), np.float32)
+        add[:, self.X], add[:, self.Y] = center
+        add[0, self.LIFE] = life
+        add[0, self.KIND] = self.FLAME
+        angle = self.rng.uniform(0, 2*math.pi, sparks)
+        speed = self.rng.uniform(2, 6, sparks)
+        add[1:, self.VX] = speed*np.cos(angle)
+        add[1:, self.VY] = speed*np.sin(angle) - 2  # 少し上向きに飛ばす
+        add[1:, self.AY] = self.gravity
+        add[1:, self.LIFE] = self.rng.integers(15, 36, sparks)
+        add[1:, self.KIND] = self.SPARK
+        add[:, self.PX] = add[:, self.X]
+        add[:, self.PY] = add[:, self.Y]
+        while self.n + len(add) > len(self.data):
+            self.data = np.concatenate([self.data, np.zeros_like(self.data)])
+        self.data[self.n:self.n + len(add)] = add
+        self.n += len(add)
+        self.flames += 1
+
+    def __len__(self) -> int:
+        return self.n
+
+    def update(self):
+        """
+        すべての粒子を1tick分動かし，寿命が尽きたものと画面の下に落ちたものを取り除く
+        """
+        if not self.n:  # 爆発がないtickは配列演算をしない
+            return
+        d = self.data[:self.n]
+        d[:, self.PX] = d[:, self.X]
+        d[:, self.PY] = d[:, self.Y]
+        d[:, self.X] += d[:, self.VX]
+        d[:, self.Y] += d[:, self.VY]
+        d[:, self.VY] += d[:, self.AY]
+        d[:, self.AGE] += 1
+        alive = (d[:, self.AGE] < d[:, self.LIFE]) & (d[:, self.Y] < HEIGHT)
+        if not alive.all():
+            self.flames -= int(np.count_nonzero(~alive & (d[:, self.KIND] == self.FLAME)))
+            kept = d[alive]
+            self.n = len(kept)
+            self.data[:self.n] = kept
+
+    def blit_sequence(self, alpha: float = None) -> list:
+        """
+        Surface.blits用の(Surface, 位置)のリストを返す
+        引数 alpha：直前のtickから次のtickまでの経過割合（Noneなら今の位置）
+        """
+        if not self.n:
+            return []
+        d = self.data[:self.n]
+        kind = d[:, self.KIND].astype(np.intp)
+        # 経過tickの割合でコマを進める（AGE < LIFEなのでコマ数を超えない）
+        idx = self.start[kind] + (d[:, self.AGE]*self.count[kind]//d[:, self.LIFE]).astype(np.intp)
+        x, y = d[:, self.X], d[:, self.Y]
+        if alpha is not None:
+            px, py = d[:, self.PX], d[:, self.PY]
+            x = px + (x - px)*alpha
+            y = py + (y - py)*alpha
+        half = self.half[idx]
+        x = np.round(x - half[:, 0]).astype(np.int32)
+        y = np.round(y - half[:, 1]).astype(np.int32)
+        frames = self.frames
+        return [(frames[i], (xi, yi)) for i, xi, yi in zip(idx.tolist(), x.tolist(), y.tolist())]
+
+
+class HudText:
+    """
+    「ラベル: 数値」の文字を，数値が変わったときだけ作り直すクラス
+    ラベルと1文字ずつの数字グリフはキャッシュしておき，組み合わせるだけで作る
+    """
+    render_calls = 0  # font.renderを呼んだ回数（全インスタンスの合計）
+    glyphs = {}  # (大きさ, アンチエイリアス, 色, 文字列)→文字Surface
+
+    def __init__(self, label: str, size: int, color: tuple[int, int, int], antialias: bool):
+        """
+        引数1 label：数値の前に付ける文字列
+        引数2 size：文字の大きさ
+        引数3 color：文字の色
+        引数4 antialias：アンチエイリアスするかどうか
+        """
+        self.font = assets.font(None, size)
+        self.key = (size, antialias, color)
+        self.prefix = self.glyph(label)
+        self.value = None
+        self.image = None
+
+    def glyph(self, txt: str) -> pg.Surface:
+        """
+        文字列のSurfaceをキャッシュから返す（なければ描画してキャッシュする）
+        """
+        key = self.key + (txt,)
+        img = __class__.glyphs.get(key)
+        if img is None:
+            size, antialias, color = self.key
+            img = self.font.render(txt, antialias, color)
+            __class__.render_calls += 1
+            __class__.glyphs[key] = img
+        return img
+
+    def set(self, value) -> pg.Surface:
+        """
+        表示する数値を設定し，文字Surfaceを返す
+        数値が前回と同じなら作り直さない
+        """
+        if value != self.value:
+            self.value = value
+            parts = [self.prefix] + [self.glyph(ch) for ch in str(value)]
+            width = sum(img.get_width() for img in parts)
+            height = max(img.get_height() for img in parts)
+            self.image = pg.Surface((width, height), pg.SRCALPHA)
+            x = 0
+            for img in parts:
+                self.image.blit(img, (x, 0))
+                x += img.get_width()
+        return self.image
+
+
+class Score():
+    """
+    打ち落とした爆弾，敵機の数をスコアとして表示するクラス
+    爆弾：1点
+    敵機：10点
+    """
+    def __init__(self):
+        self.text = HudText("Score: ", 50, (0, 0, 255), False)
+        self.value = 0
+        self.image = self.text.set(self.value)
+        self.rect = self.image.get_rect()
+        self.rect.center = 100, 50
+
+    def surface(self) -> tuple[pg.Surface, pg.Rect]:
+        """
+        現在のスコアの文字Surfaceと表示位置を返す
+        """
+        self.image = self.text.set(self.value)
+        return self.image, self.rect
+
+    def update(self, screen: pg.Surface):
+        screen.blit(*self.surface())
+
+
+class Lv():
     """
     敵の出現頻度をレベルによって管理して表示するクラス
     """
     lv_dic = {0:300, 1:250, 2:200, 3:150, 4:100, 5:75, 6:50, 7:40, 8:30}
 
     def __init__(self):
-        self.font = pg.font.Font(None, 50)
-        self.color = (0, 0, 255)
+        self.text = HudText("Lv: ", 50, (0, 0, 255), False)
         self.lv = 0
         self.freq = 300
-        self.image = self.font.render(f"Lv: {self.lv}", 0, self.color)
+        self.image = self.text.set(self.lv)
         self.rect = self.image.get_rect()
         self.rect.center = 100, 100
 
-    def update(self, screen: pg.Surface, tmr):
+    def advance(self, tmr: int):
         """
-        レベルを時間経過によって変更して表示するクラス
+        レベルを時間経過によって変更する
         """
         if self.lv <8:
             self.lv = tmr//1000
         self.freq = Lv.lv_dic[self.lv]
-        self.image = self.font.render(f"Lv: {self.lv}", 0, self.color)
-        screen.blit(self.image, self.rect)
+
+    def surface(self) -> tuple[pg.Surface, pg.Rect]:
+        """
+        現在のレベルの文字Surfaceと表示位置を返す
+        """
+        self.image = self.text.set(self.lv)
+        return self.image, self.rect
+
+    def update(self, screen: pg.Surface, tmr):
+        """
+        レベルを時間経過によって変更して表示するクラス
+        """
+        self.advance(tmr)
+        screen.blit(*self.surface())
 
 
 class Fontdraw(pg.sprite.Sprite):
@@ -383,20 +1484,85 @@ class Fontdraw(pg.sprite.Sprite):
         引数3 centerxy：文字を表示させる真ん中の位置
         """
         super().__init__()
-        font = pg.font.Font(None, size)
-        self.image = font.render(txt , True, color)
+        self.font = assets.font(None, size)
+        self.color = color
+        self.centerxy = centerxy
+        self.txt = None
+        self.set_text(txt)
+
+    def set_text(self, txt: str) -> bool:
+        """
+        表示させる文字列を変更する（同じ文字列なら作り直さない）
+        戻り値：文字を作り直したかどうか
+        """
+        if txt == self.txt:
+            return False
+        self.txt = txt
+        self.image = self.font.render(txt , True, self.color)
         self.rect = self.image.get_rect()
-        self.rect.centerx, self.rect.centery = centerxy
+        self.rect.centerx, self.rect.centery = self.centerxy
+        return True
 
     def update(self):
         pass
 
 
+class MenuScreen:
+    """
+    背景と文字，選択カーソルからなるメニュー画面を管理するクラス
+    一度作った画面は使い回し，文字が変わった行だけ作り直す
+    """
+    def __init__(self, options: list[str] = ()):
+        """
+        引数 options：カーソルで選ぶ行の名前のリスト
+        """
+        self.texts = {}  # 行の名前→Fontdraw
+        self.options = list(options)
+        self.cursor = assets.get("9.png", ("rotozoom", 0, 1.0)) #選択用画像
+        self.base = None  # 背景と文字を描いた画面（文字が変わったら作り直す）
+
+    def add(self, name: str, txt: str, size: int, centerxy: tuple[int, int]):
+        """
+        行を追加する
+        """
+        self.texts[name] = Fontdraw(txt, size, centerxy)
+        self.base = None
+
+    def set_text(self, name: str, txt: str):
+        """
+        行の文字列を変更する
+        """
+        if self.texts[name].set_text(txt):
+            self.base = None
+
+    def draw(self, screen: pg.Surface, selection_index: int = 0):
+        """
+        画面を描画する
+        引数2 selection_index：カーソルを置く選択肢の番号
+        """
+        if self.base is None:
+            self.base = pg.Surface((WIDTH, HEIGHT))
+            self.base.blit(assets.get("pg_bg.jpg"), [0, 0])
+            for txt in self.texts.values():
+                self.base.blit(txt.image, txt.rect)
+        screen.blit(self.base, [0, 0])
+        if self.options:
+            selected_text = self.texts[self.options[selection_index % len(self.options)]] #現在の選択項目に画像を配置
+            img_rect = self.cursor.get_rect()
+            img_rect.right = selected_text.rect.left - 10
+            img_rect.centery = selected_text.rect.centery
+            screen.blit(self.cursor, img_rect)
+
+
 class MP:
     """MP（マジックポイント）を表示・管理するクラス"""
+    costs = {"e": 1, "w": 5, "q": 7}  # 強化ビームごとの消費MP
+
     def __init__(self):
-        self.font = pg.font.Font(None, 40)
+        self.text = HudText("MP: ", 40, (0, 0, 255), True)
         self.value = 0  # 初期MP値を0に設定
+        self.rect = self.text.set(self.value).get_rect()
+        self.rect.topleft = (0,670)
 
     def increase(self, amount=1):
         """MPを増やすメソッド"""
@@ -409,21 +1575,20 @@ class MP:
             return True
         return False
 
+    def surface(self) -> tuple[pg.Surface, pg.Rect]:
+        """現在のMPの文字Surfaceと表示位置を返すメソッド"""
+        return self.text.set(self.value), self.rect
+
     def update(self, screen):
         """画面にMPを描画するメソッド"""
-        mp_surf = self.font.render(f"MP: {self.value}", True, (0, 0, 255))  
-        mp_rect = mp_surf.get_rect()
-        mp_rect.topleft = (0,670)  
-        screen.blit(mp_surf, mp_rect)
+        screen.blit(*self.surface())
 
 
-class BIGBeam(pg.sprite.Sprite):
+class BIGBeam(PooledSprite):
     """強化ビーム1を管理するクラス"""
     def __init__(self, bird, big):
         super().__init__()
-        self.image = pg.image.load(f"fig/beam.png").convert_alpha()
-        self.image = pg.transform.scale(self.image, (50, 50))  
-        self.image = pg.transform.rotate(self.image, big) 
+        self.image = assets.get("beam.png", ("scale", (50, 50)), ("rotate", big))
         self.rect = self.image.get_rect()
         self.vx = math.cos(math.radians(big))
         self.vy = -math.sin(math.radians(big))
@@ -441,13 +1606,11 @@ class BIGBeam(pg.sprite.Sprite):
             self.kill()
 
 
-class EnhancedImageBeam(pg.sprite.Sprite):
+class EnhancedImageBeam(PooledSprite):
     """強化ビーム2を管理するクラス"""
     def __init__(self, bird, angle_offset):
         super().__init__()
-        self.image = pg.image.load(f"fig/beam.png").convert_alpha()
-        self.image = pg.transform.scale(self.image, (50, 50))  
-        self.image = pg.transform.rotate(self.image, angle_offset) 
+        self.image = assets.get("beam.png", ("scale", (50, 50)), ("rotate", angle_offset))
         self.rect = self.image.get_rect()
         self.vx = math.cos(math.radians(angle_offset))
         self.vy = -math.sin(math.radians(angle_offset))
@@ -465,13 +1628,11 @@ class EnhancedImageBeam(pg.sprite.Sprite):
             self.kill()
 
 
-class StrongBeam(pg.sprite.Sprite):
+class StrongBeam(PooledSprite):
     """MPを5消費して発射する、強力な大きいビーム"""
     def __init__(self, bird,offset):
         super().__init__()
-        self.image = pg.image.load(f"fig/beam.png").convert_alpha()
-        self.image = pg.transform.scale(self.image, (200,50))  
-        self.image = pg.transform.rotate(self.image, offset) 
+        self.image = assets.get("beam.png", ("scale", (200, 50)), ("rotate", offset))
         self.rect = self.image.get_rect()
         self.vx = math.cos(math.radians(offset))
         self.vy = -math.sin(math.radians(offset))
@@ -493,10 +1654,21 @@ class Boss(pg.sprite.Sprite):
     """
     ボスに関するクラス
     """
-    imgs = [pg.transform.rotozoom(pg.image.load(f"fig/alien{3}.png"), 0, 2)]
+    image_keys = [("alien3.png", (("rotozoom", 0, 2),))]  # (ファイル名, 加工手順タプル)
+    imgs = []  # 画面を作ってから最初のボスを作るときに読み込む
+    max_hp = 100  # 出現したときの体力
+
+    @classmethod
+    def load_images(cls):
+        """
+        ボスの画像を読み込む（画面を作った後に呼ぶと表示形式に変換された画像になる）
+        """
+        cls.imgs = [assets.get(name, *ops) for name, ops in cls.image_keys]
     
     def __init__(self):
         super().__init__()
+        if not __class__.imgs:
+            __class__.load_images()
         self.image = random.choice(__class__.imgs)
         self.rect = self.image.get_rect()
         self.rect.center = WIDTH // 2, 0
@@ -504,7 +1676,10 @@ class Boss(pg.sprite.Sprite):
         self.bound = 100  # 停止位置
         self.state = "down"  # 降下状態or停止状態
         self.interval = random.randint(50, 300)  # 爆弾投下インターバル
-        self.hp = 100  # ボスの体力
+        self.hp = __class__.max_hp  # ボスの体力
+        self.on_stop = None  # 停止状態になったときに呼ぶ関数（爆弾投下の予約）
+        self.bar = None  # 描いておいたHPバーのSurface
+        self.bar_hp = None  # barを描いたときの体力
         
     def update(self):
         """
@@ -513,98 +1688,1837 @@ class Boss(pg.sprite.Sprite):
         """
         if self.rect.centery > self.bound:
             self.vy = 0
-            self.state = "stop"
+            if self.state != "stop":
+                self.state = "stop"
+                if self.on_stop is not None:
+                    self.on_stop(self)
         self.rect.move_ip(self.vx, self.vy)
 
-    def draw_hp_bar(self, screen):
+    def hit(self, damage: float) -> bool:
+        """
+        ビームが当たったときの処理
+        体力が10以下ならTrue（倒された）を返し，そうでなければ体力をdamage減らしてFalseを返す
+        （当たった時点の体力で判定するので，体力が10を切ってからもう1回当てると倒れる）
+        """
+        if self.hp <= 10:
+            return True
+        if self.hp > 0:
+            self.hp -= damage
+        return False
+
+    def draw_hp_bar(self, screen, cache: bool = False):
         """
         ボスのhpを表示する
+        引数1 screen：画面Surface
+        引数2 cache：Trueなら体力が変わったときだけバーを描き直し，それ以外は描いておいたバーを転送する
+        戻り値：HPバーを描いた矩形
         """
         bar_width = self.rect.width
         bar_height = 10
-        fill_width = int(bar_width * (self.hp / 100))
-        pg.draw.rect(screen, (255, 0, 0), (self.rect.left - 150, self.rect.top - 20, 3 * bar_width, bar_height))
+        fill_width = int(bar_width * (self.hp / self.max_hp))
+        if cache:
+            if self.bar is None or self.bar_hp != self.hp:
+                self.bar = pg.Surface((3 * bar_width, bar_height))
+                self.bar.fill((255, 0, 0))
+                self.bar.fill((0, 255, 0), (0, 0, 3 * fill_width, bar_height))
+                self.bar_hp = self.hp
+            return screen.blit(self.bar, (self.rect.left - 150, self.rect.top - 20))
+        rect = pg.draw.rect(screen, (255, 0, 0), (self.rect.left - 150, self.rect.top - 20, 3 * bar_width, bar_height))
         # 背景の赤いバー
         pg.draw.rect(screen, (0, 255, 0), (self.rect.left - 150, self.rect.top - 20, 3 * fill_width, bar_height))
         # HPに応じた緑色のバー
+        return rect
+
+
+class ScoreWriter:
+    """
+    ランキングファイルを別スレッドで書き込むクラス
+    一時ファイルに書いてからos.replaceで置き換えるので，書き込み中に落ちても
+    ファイルには前の内容か新しい内容のどちらかが必ず残る
+    書き込みが追いつかないときは最新の内容だけを書く
+    """
+    def __init__(self, path: str):
+        """
+        引数 path：ランキングファイルのパス
+        """
+        self.path = path
+        self.queue = queue.Queue()
+        self.writes = 0  # 書き込んだ回数
+        self.thread = threading.Thread(target=self.run, name="ScoreWriter", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)  # 終了時に書き残しがないようにする
+
+    def save(self, text: str):
+        """
+        ファイルの内容textの書き込みを頼む（すぐに戻る）
+        """
+        self.queue.put(text)
+
+    def run(self):
+        """
+        書き込みスレッドの本体：頼まれた内容をファイルに書く（Noneが来たら終わる）
+        """
+        while True:
+            items = [self.queue.get()]
+            while not self.queue.empty():  # 溜まっている分はまとめる
+                items.append(self.queue.get_nowait())
+            texts = [item for item in items if item is not None]
+            if texts:
+                self.write(texts[-1])
+            if None in items:
+                return
+
+    def write(self, text: str):
+        """
+        一時ファイルに書いてディスクに書き出してから，元のファイルと置き換える
+        """
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as wf:
+                wf.write(text)
+                wf.flush()
+                os.fsync(wf.fileno())
+            os.replace(tmp, self.path)
+            self.writes += 1
+        except OSError as e:
+            print(f"ランキングを保存できませんでした: {e}", file=sys.stderr)
+
+    def close(self):
+        """
+        書き込みを待ってスレッドを終える
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=5)
 
 
 class Scorerank():
     """
     スコアランキングを管理するクラス
+    ファイルへの書き込みはScoreWriterが別スレッドで行う
     """
+    size = 10  # ランキングに残す数
+
     def __init__(self, path: str):
         """
-        ランキングが記録されたファイルを読み込む
-        ない場合は新たに作成する
+        ランキングを開き，上位のスコアと名前をranklst・namelstに読み込む（開き方はopen()で決める）
         引数1 ファイルのパス
         """
         self.path = path
+        self.open()
+
+    def open(self):
+        """
+        ランキングが記録されたファイルを読み込み，書き込み用のScoreWriterを用意する
+        ない場合や読めない場合は0点のランキングから始める
+        """
+        self.writer = ScoreWriter(self.path)
+        self.ranklst, self.namelst = self.load(self.path)
+        if not os.path.exists(self.path):
+            self.save()
+
+    @classmethod
+    def load(cls, path: str) -> tuple[list[int], list[str]]:
+        """
+        ランキングファイルを読み込み，(スコアのリスト, 名前のリスト)を返す
+        1行目はスコア，2行目は名前をそれぞれ,で区切ったもの
+        """
+        ranklst, namelst = [], []
         try:
             with open(path, "r", encoding="utf-8") as rf:
                 score = rf.readline()
                 name = rf.readline()
+            ranklst = [int(i) for i in score.split(",")] #int型のリストに変換
+            namelst = name.rstrip("\n").split(",")
         except FileNotFoundError: #ファイルが見つからなかったら
-            txt = "0,0,0,0,0,0,0,0,0,0\nNoName,NoName,NoName,NoName,NoName,NoName,NoName,NoName,NoName,NoName" #10個の0点の文字列作成
-            with open(path, "w", encoding="utf-8") as wf:
-                wf.write(txt)
-            with open(path, "r", encoding="utf-8") as rf:
-                score = rf.readline()
-                name = rf.readline()
-        self.ranklst = [int(i) for i in score.split(",")] #int型のリストに変換
-        self.namelst = name.split(",")
-
-    def update(self, score:int, name:str):
-        self.ranklst.append(score) #新しいスコアをリストに追加してソートする
-        self.namelst.append(name)
-        zip_lst = zip(self.ranklst, self.namelst)
-        zip_lst = sorted(zip_lst, reverse=True)
-        self.ranklst, self.namelst = zip(*zip_lst)
-        self.ranklst = list(self.ranklst)
-        self.namelst = list(self.namelst)
+            pass
+        except (OSError, ValueError) as e:  # 手で書き換えるなどして読めなかったら
+            print(f"ランキングを読み込めませんでした: {e}", file=sys.stderr)
+            ranklst, namelst = [], []
+        # 数が足りなければ0点で埋め，多ければ切り詰める
+        entries = sorted(zip(ranklst, namelst + ["NoName"]*(len(ranklst)-len(namelst))),
+                         key=lambda entry: -entry[0])[:cls.size]
+        entries += [(0, "NoName")]*(cls.size-len(entries))
+        return [entry[0] for entry in entries], [entry[1] for entry in entries]
+
+    def insert(self, score: int, name: str) -> bool:
+        """
+        スコアを上位のリストの順位の位置に挿入する
+        同点のときは先に記録したスコアが上になる
+        戻り値：上位のリストが変わったかどうか
+        """
+        idx = bisect.bisect_right(self.ranklst, -score, key=lambda rank: -rank)  # 降順のリストに二分探索
+        if idx >= len(self.ranklst):  # ランキング外なら何もしない
+            return False
+        self.ranklst.insert(idx, score)
+        self.namelst.insert(idx, name)
         self.ranklst.pop(-1) #1つ増えた分減らす
         self.namelst.pop(-1)
-        with open(self.path, "w", encoding="utf-8") as wf:
-                wf.write(','.join(map(str, self.ranklst))) #,で区切られた文字列に直して書き込む
-                wf.write("\n" + ','.join(self.namelst))
-        
+        return True
+
+    def update(self, score:int, name:str, level: int = None, ticks: int = None):
+        """
+        1ゲームの結果を記録する（ファイルには上位のスコアと名前だけを残す）
+        ランキングが変わったらファイルの書き込みを頼む
+        """
+        if self.insert(score, name):
+            self.save()
+
+    def save(self):
+        """
+        今のランキングを,で区切った文字列にしてScoreWriterに渡す
+        """
+        self.writer.save(','.join(map(str, self.ranklst)) + "\n" + ','.join(self.namelst))
+
+    def count(self) -> int:
+        """
+        ランキングに載っている数を返す
+        """
+        return len(self.ranklst)
+
+    def page(self, offset: int, limit: int) -> list[tuple[int, str]]:
+        """
+        offset位の次からlimit件の(スコア, 名前)のリストを返す
+        """
+        return list(zip(self.ranklst, self.namelst))[offset:offset+limit]
+
+
+class SqliteRank(Scorerank):
+    """
+    すべてのゲームの記録をSQLiteに残すランキング（Scorerankと同じ使い方）
+    上位のスコアはscoresの索引から取り出し，ランキング画面はページごとに問い合わせる
+    書き込みは別スレッドで，溜まった記録を1つのトランザクションでまとめて行う
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS players (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY,
+            player_id INTEGER NOT NULL REFERENCES players(id),
+            played_at REAL,  -- UNIX時刻（移行した記録はNULL）
+            level INTEGER,  -- 終了時のレベル
+            ticks INTEGER  -- 遊んだtick数
+        );
+        CREATE TABLE IF NOT EXISTS scores (
+            game_id INTEGER PRIMARY KEY REFERENCES games(id),
+            player_id INTEGER NOT NULL REFERENCES players(id),
+            score INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE INDEX IF NOT EXISTS scores_rank ON scores(score DESC, game_id);
+        CREATE INDEX IF NOT EXISTS scores_player ON scores(player_id, score DESC);
+        CREATE INDEX IF NOT EXISTS games_player ON games(player_id, played_at DESC);
+        CREATE INDEX IF NOT EXISTS games_time ON games(played_at DESC);
+        CREATE INDEX IF NOT EXISTS games_level ON games(level);
+    """
+
+    def __init__(self, path: str, legacy_path: str = None):
+        """
+        引数1 path：データベースファイルのパス
+        引数2 legacy_path：移行するテキストのランキングファイル（一度だけ取り込む）
+        """
+        self.legacy_path = legacy_path
+        super().__init__(path)
+
+    def open(self):
+        """
+        データベースを開き（なければ作り），上位のスコアを読み込んで書き込みスレッドを始める
+        """
+        self.conn = sqlite3.connect(self.path)  # 読み出し用（メインスレッドだけで使う）
+        self.conn.execute("PRAGMA journal_mode=WAL")  # 書き込み中も読み出せるようにする
+        self.conn.executescript(self.schema)
+        if self.legacy_path is not None:
+            self.migrate(self.legacy_path)
+        self.queue = queue.Queue()
+        rows = self.page(0, self.size)
+        rows += [(0, "NoName")]*(self.size-len(rows))
+        self.ranklst = [row[0] for row in rows]
+        self.namelst = [row[1] for row in rows]
+        self.batches = 0  # 書き込んだトランザクションの数
+        self.thread = threading.Thread(target=self.run, name="SqliteRank", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def migrate(self, legacy_path: str):
+        """
+        テキストのランキングファイルの記録を取り込む（0点のNoNameは空き枠なので除く）
+        """
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_migrated'").fetchone():
+            return
+        if os.path.exists(legacy_path):
+            ranklst, namelst = Scorerank.load(legacy_path)
+            games = [(score, name, None, None, None) for score, name in zip(ranklst, namelst)
+                     if not (score == 0 and name == "NoName")]
+            with self.conn:
+                self.insert_games(self.conn, games)
+        with self.conn:
+            self.conn.execute("INSERT INTO meta VALUES ('legacy_migrated', ?)", (legacy_path,))
+
+    @staticmethod
+    def insert_games(conn: sqlite3.Connection, games: list[tuple]):
+        """
+        (スコア, 名前, 時刻, レベル, tick数)のリストを記録する（トランザクションは呼び出し側で）
+        ゲームの番号はこちらで続き番号を振り，表ごとにexecutemanyの1回でまとめて書き込む
+        """
+        conn.executemany("INSERT INTO players(name) VALUES (?) ON CONFLICT(name) DO NOTHING",
+                         [(game[1],) for game in games])
+        start = conn.execute("SELECT COALESCE(MAX(id), 0) FROM games").fetchone()[0] + 1
+        conn.executemany("INSERT INTO games(id, player_id, played_at, level, ticks) "
+                         "SELECT ?, id, ?, ?, ? FROM players WHERE name = ?",
+                         [(start + i, played_at, level, ticks, name)
+                          for i, (score, name, played_at, level, ticks) in enumerate(games)])
+        conn.executemany("INSERT INTO scores(game_id, player_id, score) SELECT ?, id, ? FROM players WHERE name = ?",
+                         [(start + i, score, name) for i, (score, name, *_) in enumerate(games)])
+
+    def update(self, score:int, name:str, level: int = None, ticks: int = None):
+        """
+        1ゲームの結果を上位のリストに反映し，データベースへの書き込みを頼む（すぐに戻る）
+        """
+        self.insert(score, name)
+        self.queue.put((score, name, time.time(), level, ticks))
+
+    def run(self):
+        """
+        書き込みスレッドの本体：溜まった記録をまとめて書き込む（Noneが来たら終わる）
+        """
+        conn = sqlite3.connect(self.path)
+        while True:
+            items = [self.queue.get()]
+            while not self.queue.empty():
+                items.append(self.queue.get_nowait())
+            games = [item for item in items if item is not None]
+            if games:
+                try:
+                    with conn:
+                        self.insert_games(conn, games)
+                    self.batches += 1
+                except sqlite3.Error as e:
+                    print(f"ランキングを保存できませんでした: {e}", file=sys.stderr)
+            for _ in items:
+                self.queue.task_done()
+            if None in items:
+                conn.close()
+                return
+
+    def flush(self, timeout: float = 5.0):
+        """
+        頼んだ書き込みが終わるまで待つ
+        書き込みスレッドが止まっているときやtimeout秒たっても終わらないときは，待つのをやめてそのまま読む
+        （ランキング画面が固まらないように，書き込まれていない記録は表示に入らない）
+        """
+        done = self.queue.all_tasks_done
+        end = time.monotonic() + timeout
+        with done:
+            while self.queue.unfinished_tasks:
+                if not self.thread.is_alive():
+                    print("ランキングの書き込みスレッドが止まっています", file=sys.stderr)
+                    return
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    print("ランキングの書き込みを待ちきれませんでした", file=sys.stderr)
+                    return
+                done.wait(min(remaining, 0.1))
+
+    def close(self):
+        """
+        書き込みを待ってスレッドを終える
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+
+    def count(self) -> int:
+        """
+        記録したゲームの数を返す
+        """
+        self.flush()
+        return self.conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def page(self, offset: int, limit: int) -> list[tuple[int, str]]:
+        """
+        offset位の次からlimit件の(スコア, 名前)のリストを返す（scores_rankの索引順に読むだけ）
+        """
+        self.flush()
+        return self.conn.execute(
+            "SELECT s.score, p.name FROM scores s JOIN players p ON p.id = s.player_id "
+            "ORDER BY s.score DESC, s.game_id LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+
+    def best(self, name: str) -> Union[int, None]:
+        """
+        プレイヤーの最高スコアを返す（記録がなければNone）
+        """
+        self.flush()
+        return self.conn.execute(
+            "SELECT MAX(s.score) FROM scores s JOIN players p ON p.id = s.player_id WHERE p.name = ?",
+            (name,)).fetchone()[0]
+
+    def recent(self, limit: int = 10, name: str = None) -> list[tuple]:
+        """
+        最近のゲームの(時刻, 名前, スコア, レベル)のリストを新しい順に返す
+        引数2 name：指定したらそのプレイヤーのゲームだけ
+        """
+        self.flush()
+        where = "WHERE p.name = ?" if name is not None else "WHERE g.played_at IS NOT NULL"
+        params = (name, limit) if name is not None else (limit,)
+        return self.conn.execute(
+            "SELECT g.played_at, p.name, s.score, g.level FROM games g "
+            "JOIN players p ON p.id = g.player_id JOIN scores s ON s.game_id = g.id "
+            f"{where} ORDER BY g.played_at DESC LIMIT ?", params).fetchall()
+
+    def level_stats(self) -> list[tuple]:
+        """
+        終了時のレベルごとの(レベル, ゲーム数, 平均スコア, 最高スコア)のリストを返す
+        """
+        self.flush()
+        return self.conn.execute(
+            "SELECT g.level, COUNT(*), AVG(s.score), MAX(s.score) FROM games g "
+            "JOIN scores s ON s.game_id = g.id WHERE g.level IS NOT NULL "
+            "GROUP BY g.level ORDER BY g.level").fetchall()
+
+
+def print_rank_report(rank: Scorerank, name: str = None):
+    """
+    ランキングの上位と，SQLiteならレベルごとの集計・最近のゲームを表示する
+    引数2 name：指定したらそのプレイヤーの最高スコアと最近のゲームを表示する
+    """
+    print(f"games: {rank.count()}")
+    for i, (score, player) in enumerate(rank.page(0, Scorerank.size)):
+        print(f"No.{i+1} : {player} {score}")
+    if not isinstance(rank, SqliteRank):
+        return
+    if name:
+        print(f"best of {name}: {rank.best(name)}")
+    for level, games, avg, best in rank.level_stats():
+        print(f"Lv {level}: {games} games, avg {avg:.1f}, best {best}")
+    for played_at, player, score, level in rank.recent(10, name or None):
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(played_at)) if played_at else "-"
+        print(f"{when} {player} {score} (Lv {level})")
+
+
+def open_rank(store: str = "sqlite") -> Scorerank:
+    """
+    ランキングの保存先を開く
+    引数 store："sqlite"（全記録をデータベースに残す）または"file"（上位10件をテキストファイルに残す）
+    """
+    if store == "file":
+        return Scorerank(os.path.join(BASE_DIR, "kokaton_invader_score.txt")) #ファイルパスを渡してランクの作成
+    return SqliteRank(os.path.join(BASE_DIR, "kokaton_invader.db"),
+                      legacy_path=os.path.join(BASE_DIR, "kokaton_invader_score.txt"))
+
+
+class FrameProfiler:
+    """
+    ゲーム画面の1フレームをフェーズごとに計測するクラス
+    F3キーで画面右上に移動平均とフレーム時間のグラフを表示し，
+    CSVファイルを指定するとフレームごとの計測値とスプライト数を書き出す
+    表示もCSVもオフのときは計測しない
+    """
+    phases = ["clear", "input", "spawn", "collision", "update", "draw", "hud", "flip"]
+    window = 120  # 移動平均とグラフに使うフレーム数
+
+    def __init__(self, csv_path: str = None, overlay: bool = False, budget: float = None):
+        """
+        引数1 csv_path：計測値を書き出すCSVファイルのパス（Noneなら書き出さない）
+        引数2 overlay：最初から表示するかどうか
+        引数3 budget：グラフの基準線にする1フレームの時間（ミリ秒，省略時は1tickの時間）
+        """
+        self.overlay = overlay
+        self.budget = budget if budget else 1000/Game.tick_rate
+        self.csv = None
+        self.csv_header = False
+        if csv_path:
+            self.csv = open(csv_path, "w", encoding="utf-8", newline="")
+        self.active = overlay or self.csv is not None
+        self.history = {phase: collections.deque(maxlen=self.window) for phase in self.phases}
+        self.totals = collections.deque(maxlen=self.window)
+        self.frame = 0
+        self.tier = 0  # 直前のフレームの品質の段階
+        self.times = {}
+        self.last = 0.0
+        self.font = None
+        # 表示用のSurfaceは一度だけ作り，毎回塗りつぶして描き直す（計測する処理を増やさない）
+        self.text_img = pg.Surface((160, 16*(len(self.phases) + 2) + 4))  # フェーズ＋フレーム＋品質の行
+        self.text_img.set_alpha(200)
+        self.text_ready = False  # text_imgに文字を描いたか
+        self.graph = pg.Surface((160, 40))
+        self.graph.set_alpha(200)
+
+    def toggle(self):
+        """
+        画面表示を切り替える
+        """
+        self.overlay = not self.overlay
+        self.active = self.overlay or self.csv is not None
+
+    def begin(self):
+        """
+        フレームの計測を始める
+        """
+        self.times = {}
+        self.start = self.last = time.perf_counter()
+
+    def lap(self, phase: str):
+        """
+        直前のlapからの経過時間をphaseの時間として記録する
+        """
+        now = time.perf_counter()
+        self.times[phase] = self.times.get(phase, 0.0) + (now-self.last)*1000
+        self.last = now
+
+    def end(self, counts: dict, tier: int = 0):
+        """
+        フレームの計測を終え，履歴とCSVに記録する
+        引数1 counts：スプライトグループ名→数の辞書
+        引数2 tier：FrameGovernorの品質の段階
+        """
+        self.tier = tier
+        total = (time.perf_counter()-self.start)*1000
+        self.totals.append(total)
+        for phase in self.phases:
+            self.history[phase].append(self.times.get(phase, 0.0))
+        if self.csv is not None:
+            if not self.csv_header:
+                self.csv.write(",".join(["frame", "total_ms"] + [f"{p}_ms" for p in self.phases] + list(counts)
+                                        + ["tier"]) + "\n")
+                self.csv_header = True
+            row = [str(self.frame), f"{total:.4f}"]
+            row += [f"{self.times.get(phase, 0.0):.4f}" for phase in self.phases]
+            row += [str(num) for num in counts.values()]
+            row.append(str(tier))
+            self.csv.write(",".join(row) + "\n")
+        self.frame += 1
+
+    def averages(self) -> dict:
+        """
+        フェーズごとの移動平均（ミリ秒）を返す
+        """
+        return {phase: sum(vals)/len(vals) if vals else 0.0 for phase, vals in self.history.items()}
+
+    def draw(self, renderer: "Renderer"):
+        """
+        移動平均とフレーム時間のグラフを画面右上に描画する
+        """
+        if not self.overlay:
+            return
+        if self.font is None:
+            self.font = assets.font(None, 20)
+        if not self.text_ready or self.frame % 10 == 0:  # 文字は10フレームごとに作り直す
+            lines = [f"{phase:9s} {ms:6.2f} ms" for phase, ms in self.averages().items()]
+            avg = sum(self.totals)/len(self.totals) if self.totals else 0.0
+            lines.append(f"{'frame':9s} {avg:6.2f} ms")
+            lines.append(f"{'quality':9s} tier {self.tier}")
+            self.text_img.fill((0, 0, 0))
+            for i, line in enumerate(lines):
+                self.text_img.blit(self.font.render(line, True, (255, 255, 255)), (4, 2 + 16*i))
+            self.text_ready = True
+        rect = renderer.blit(self.text_img, (WIDTH-164, 4))
+        graph = self.graph
+        graph.fill((0, 0, 0))
+        budget = self.budget
+        pg.draw.line(graph, (255, 255, 0), (0, 20), (159, 20))  # 予算の線（高さの半分）
+        left = 160 - len(self.totals)  # 最新のフレームが右端
+        for i, total in enumerate(self.totals):
+            h = min(40, int(total/budget*20))
+            color = (0, 255, 0) if total <= budget else (255, 0, 0)
+            pg.draw.line(graph, color, (left+i, 39), (left+i, 39-h))
+        renderer.blit(graph, (WIDTH-164, rect.bottom + 2))
+
+    def close(self):
+        """
+        CSVファイルを閉じる
+        """
+        if self.csv is not None:
+            self.csv.close()
+            self.csv = None
+            self.active = self.overlay
+
+
+QualityTier = collections.namedtuple("QualityTier", ["life", "sparks", "max_exps", "hud_every", "bar_cache"])
+
+
+class FrameGovernor:
+    """
+    1フレームの処理時間を予算と比べ，足りないときは見た目だけの処理を段階的に減らすクラス
+    処理時間の指数移動平均が予算のhigh倍を超えるフレームがdown_after回続いたら品質を1段下げ，
+    low倍を下回るフレームがup_after回続いたら1段上げる
+    上げてすぐにまた下げたときは，次に上げるまでのフレーム数を倍にして行ったり来たりを防ぐ
+    ゲームの進行（乱数・衝突・スコア）には関係しないものだけを減らすので，リプレイの結果は変わらない
+    """
+    tiers = [  # 品質の段階（上から順に下げていく）
+        # 爆発の長さの倍率，火花の数の倍率，同時に出せる爆発の数，HUDの数値を作り直す間隔，ボスのHPバーを体力が変わったときだけ作り直すか
+        QualityTier(1.0, 1.0, None, 1, False),
+        QualityTier(1.0, 0.5, 48, 1, True),
+        QualityTier(0.6, 0.25, 24, 3, True),
+        QualityTier(0.4, 0.0, 12, 6, True),
+    ]
+    high = 0.9
+    low = 0.5
+    down_after = 10
+    up_after = 150
+    smoothing = 0.1  # 指数移動平均の重み
+
+    def __init__(self, budget: float = 20.0):
+        """
+        引数 budget：1フレームの処理時間の予算（ミリ秒，0なら品質を下げない）
+        """
+        self.budget = budget
+        self.tier = 0
+        self.avg = 0.0  # 処理時間の指数移動平均（ミリ秒）
+        self.over = 0  # 予算を超えたフレームが続いている数
+        self.under = 0  # 余裕のあるフレームが続いている数
+        self.hold = self.up_after  # 品質を上げるまでに待つフレーム数
+        self.since_up = None  # 最後に品質を上げてからのフレーム数
+        self.changes = 0
+        self.frames = [0]*len(self.tiers)  # 段階→その段階で描いたフレーム数
+
+    @property
+    def quality(self) -> QualityTier:
+        """
+        今の段階の設定
+        """
+        return self.tiers[self.tier]
+
+    def update(self, ms: float):
+        """
+        1フレームの処理時間を記録し，必要なら品質の段階を変える
+        引数 ms：フレームの処理時間（ミリ秒，描画の待ち時間を除く）
+        """
+        self.frames[self.tier] += 1
+        if self.budget <= 0:
+            return
+        self.avg += (ms - self.avg)*self.smoothing
+        if self.since_up is not None:
+            self.since_up += 1
+        if self.avg > self.budget*self.high:
+            self.over += 1
+            self.under = 0
+        elif self.avg < self.budget*self.low:
+            self.under += 1
+            self.over = 0
+        else:
+            self.over = self.under = 0
+        if self.over >= self.down_after and self.tier < len(self.tiers) - 1:
+            if self.since_up is not None and self.since_up < self.hold:  # 上げたのが早すぎた
+                self.hold = min(self.hold*2, self.up_after*16)
+            self.tier += 1
+            self.changes += 1
+            self.over = 0
+            self.since_up = None
+        elif self.under >= self.hold and self.tier > 0:
+            self.tier -= 1
+            self.changes += 1
+            self.under = 0
+            self.since_up = 0
+
+    def stats(self) -> dict:
+        """
+        品質の段階の統計を辞書で返す
+        """
+        return {
+            "budget_ms": self.budget,
+            "tier": self.tier,
+            "changes": self.changes,
+            "frames_per_tier": list(self.frames),
+        }
+
+
+class TimerWheel:
+    """
+    tick単位の予定を管理するタイマーホイール
+    予定は発火するtickでslots個のスロットの環に振り分けておき，
+    毎tick今のtickのスロットだけを調べるので，予定の数が増えても1tickの手間は発火するものの分だけ
+    （slots tick以上先の予定は同じスロットで周回を待つ）
+    """
+    def __init__(self, slots: int = 512):
+        """
+        引数 slots：スロットの数
+        """
+        self.slots = [[] for _ in range(slots)]
+        self.pending = 0  # 予約中の予定の数（取り消したものを含む）
+        self.fired = 0  # 発火した予定の数
+
+    def schedule(self, tick: int, callback, order: tuple = ()) -> list:
+        """
+        tickにcallback(tick)を呼ぶ予定を入れる
+        引数1 tick：発火するtick（今のtickより後）
+        引数2 callback：呼び出す関数
+        引数3 order：同じtickに発火する予定を呼ぶ順番（小さい順）
+        戻り値：取り消しに使う予定
+        """
+        timer = [tick, order, callback]
+        self.slots[tick % len(self.slots)].append(timer)
+        self.pending += 1
+        return timer
+
+    def cancel(self, timer: list):
+        """
+        予定を取り消す（発火するtickに呼ばずに捨てる）
+        """
+        timer[2] = None
+
+    def run(self, tick: int):
+        """
+        tickに発火する予定をorderの順に呼び出す
+        """
+        idx = tick % len(self.slots)
+        slot = self.slots[idx]
+        if not slot:
+            return
+        due = [timer for timer in slot if timer[0] == tick]
+        if not due:
+            return
+        self.slots[idx] = [timer for timer in slot if timer[0] != tick]
+        self.pending -= len(due)
+        due.sort(key=lambda timer: timer[1])
+        for _, _, callback in due:
+            if callback is not None:
+                self.fired += 1
+                callback(tick)
+
+    def stats(self) -> dict:
+        """
+        予約中・発火済みの予定の数を辞書で返す
+        """
+        return {"pending": self.pending, "fired": self.fired}
 
-def main():
-    global command1
+
+class EnemyBudget:
+    """
+    画面にいられる敵機の数の上限と，上限に達したときの扱いを決めるクラス
+    cap：新しい敵機を出さない
+    oldest：いちばん古い敵機を画面の上へ退場させてから新しい敵機を出す
+    merge：新しい敵機を体力がいちばん少ない（同じなら古い）敵機に合体させる（倒すのに必要な命中数が1増える）
+    """
+    policies = ["cap", "oldest", "merge"]
+
+    def __init__(self, limit: int = 0, policy: str = "oldest"):
+        """
+        引数1 limit：退場中を除いた敵機の最大数（0なら上限なし）
+        引数2 policy：上限に達したときの扱い
+        """
+        self.limit = limit
+        self.policy = policy
+        self.refused = 0  # capで出さなかった数
+        self.retired = 0  # oldestで退場させた数
+        self.merged = 0  # mergeで合体させた数
+
+    def admit(self, emys: pg.sprite.AbstractGroup) -> bool:
+        """
+        新しい敵機を出してよいかを返す（上限に達していれば方針に応じて古い敵機を退場・合体させる）
+        引数 emys：敵機グループ
+        """
+        if not self.limit or len(emys) < self.limit:
+            return True
+        active = [emy for emy in emys if emy.state != "leave"]
+        if len(active) < self.limit:
+            return True
+        if self.policy == "oldest":
+            active[0].leave()
+            self.retired += 1
+            return True
+        if self.policy == "merge":
+            min(active, key=lambda emy: emy.hp).hp += 1
+            self.merged += 1
+            return False
+        self.refused += 1
+        return False
+
+    def stats(self) -> dict:
+        """
+        上限の設定と，これまでに上限が効いた回数を辞書で返す
+        """
+        return {"limit": self.limit, "policy": self.policy,
+                "refused": self.refused, "retired": self.retired, "merged": self.merged}
+
+
+class Game:
+    """
+    1プレイ分のゲーム状態を持ち，ゲーム画面の1フレーム分の処理を行うクラス
+    main()からも画面なしのシミュレーションからも同じ処理で動かす
+    ゲームの進行は1秒にtick_rate回の固定ステップ（tick）で行い，
+    描画は直前のtickとの間を補間して任意のフレームレートで行える
+    """
+    tick_rate = 50  # 1秒あたりのシミュレーション回数
+    key_bindings = {  # 押されたキー→操作名（handle_inputで処理する）
+        pg.K_F3: "profiler",
+        pg.K_SPACE: "beam",
+        pg.K_e: "e",
+        pg.K_w: "w",
+        pg.K_q: "q",
+    }
+    cheat_codes = {"konami": KONAMI_COMMAND}  # 隠しコマンド名→キーの並び（完成すると操作名として届く）
+    collision_groups = ["emys", "bosses", "beams", "BIG_beams", "enhanced_image_beams", "Strong_Beam", "bombs"]
+    # 衝突の表：上の行から順に，当たる側ごとに重なった弾（前の行で消されたものを除く）との効果を適用する
+    # (当たる側, 弾, 倒れたときの処理, 弾を消す, ダメージ, 得点, MP, 爆発の長さ, こうかとんが喜ぶ)
+    # ダメージが0でなければ当たる側のhit()に渡し，倒れたときだけ弾を消す以外の効果を適用する
+    # 倒れたときの処理は"kill"（グループから消す）かGameのメソッド名
+    collision_rules = [
+        ("emys", "beams", "kill", True, 1, 10, 1, 100, True),
+        ("emys", "BIG_beams", "kill", True, 1, 10, 0, 100, True),
+        ("emys", "enhanced_image_beams", "kill", True, 1, 10, 0, 100, True),
+        ("emys", "Strong_Beam", "kill", False, 1, 10, 0, 100, True),
+        ("bombs", "beams", "kill", True, 0, 1, 0, 50, False),
+        ("bosses", "beams", "defeat_boss", True, 10, 0, 0, 0, False),
+        ("bombs", "enhanced_image_beams", "kill", False, 0, 1, 0, 50, False),
+        ("bombs", "BIG_beams", "kill", True, 0, 1, 0, 50, False),
+        ("bombs", "Strong_Beam", "kill", False, 0, 1, 0, 50, False),
+        ("bosses", "enhanced_image_beams", "defeat_boss", False, 0.5, 0, 0, 0, False),
+        ("bosses", "BIG_beams", "defeat_boss", True, 5, 0, 0, 0, False),
+        ("bosses", "Strong_Beam", "defeat_boss", False, 0.8, 0, 0, 0, False),
+    ]
+    max_ticks = 5  # 1フレームで追いつくために進める最大tick数
+    # 爆発エフェクトの持ち方（"sprite"：Explosionスプライト，"particles"：ParticleSystemの配列（NumPyが必要））
+    effects = "sprite"
+    def __init__(self, screen: pg.Surface, render_mode: str = "dirty", profiler: FrameProfiler = None,
+                 projectiles: str = "sprite", budget: EnemyBudget = None, governor: FrameGovernor = None,
+                 effects: str = None):
+        """
+        引数1 screen：画面Surface
+        引数2 render_mode：描画方式（"dirty"または"full"）
+        引数3 profiler：フレーム計測（省略時は計測しない）
+        引数4 projectiles：ビーム・爆弾の持ち方（"sprite"：スプライト，"numpy"：ProjectileGroupの配列）
+        引数5 budget：敵機の数の上限（省略時は上限なし）
+        引数6 governor：処理時間に応じた見た目の品質の段階（省略時は予算20msで新しく作る）
+        引数7 effects：爆発エフェクトの持ち方（"particles"または"sprite"，省略時はGame.effects）
+        """
+        if effects is not None:
+            self.effects = effects
+        self.screen = screen
+        self.profiler = profiler if profiler is not None else FrameProfiler()
+        self.budget = budget if budget is not None else EnemyBudget()
+        self.governor = governor if governor is not None else FrameGovernor()
+        self.score = Score()
+        self.lv = Lv()
+        self.mp = MP()  # MPインスタンスの作成
+        self.boss_spown = False  # ボスの出現判定
+        self.score_tmp = 0
+        self.beam_ready = 0  # ビームを撃てるようになるtick
+        self.e_ready = 0  # 強化ビーム"E"を撃てるようになるtick
+        self.e_cooltime = 20  # 強化ビーム"E"のクールタイム（tick）
+
+        self.bird = Bird(3, (325, 650))
+        self.cheer = False  # このtickに敵機を倒してこうかとんが喜ぶか
+        if projectiles == "numpy":
+            if np is None:
+                raise ImportError("--projectiles numpy を使うにはNumPyをインストールしてください")
+            group = ProjectileGroup
+        else:
+            group = pg.sprite.Group
+        self.bombs = group()
+        self.beams = group()
+        self.BIG_beams = group()
+        self.enhanced_image_beams = group()
+        self.Strong_Beam = group()
+        if self.effects == "particles":
+            if np is None:
+                raise ImportError("--effects particles を使うにはNumPyをインストールしてください")
+            self.exps = ParticleSystem()
+        else:
+            self.exps = pg.sprite.Group()
+        self.emys = pg.sprite.Group()
+        self.bosses = pg.sprite.Group()
+
+        self.tmr = 0
+        # ゲームごとに作り直すので，前のゲームで途中まで入力したコマンドは持ち越さない（リプレイの再現のため）
+        self.inputs = InputBuffer(self.key_bindings, self.cheat_codes)
+        # 敵機の出現・爆弾投下はtickを指定して予約する
+        self.scheduler = TimerWheel()
+        self.spawned = 0  # 出現させた敵機・ボスの数（同じtickの爆弾投下をグループの並び順で行うため）
+        self.spawn_timer = self.scheduler.schedule(0, self.spawn_enemy, (0,))
+        self.renderer = Renderer(screen, assets.get("pg_bg.jpg"), dirty=(render_mode == "dirty"))
+        self.collider = ArrayCollider() if projectiles == "numpy" else RectCollider()
+        self.interpolate = False  # tick間の位置を補間して描画するか
+        self.prev_pos = {}  # スプライト→直前のtickで移動する前の位置
+        self.recorder = None  # tickごとの入力を記録するInputRecorder（記録しないときはNone）
+        self.hud = None  # 直前に描いたスコア・MP・レベルの(Surface, 位置)のリスト
+
+    def step(self, key_lst, events: list) -> bool:
+        """
+        ゲームを1tick進めて描画する
+        引数1 key_lst：押下キーの真理値リスト
+        引数2 events：このフレームに発生したイベントのリスト
+        戻り値：こうかとんが生き残っていればTrue，爆弾に当たったらFalse
+        """
+        return self.frame(key_lst, events)
+
+    def frame(self, key_lst, events: list, ticks: int = 1, alpha: float = 1.0) -> bool:
+        """
+        描画1回分の処理：ゲームをticks回進めてから描画する
+        引数1 key_lst：押下キーの真理値リスト
+        引数2 events：前回進めたtick以降に発生したイベントのリスト（最初のtickで処理する）
+        引数3 ticks：進めるtick数（0なら描画だけ行う）
+        引数4 alpha：直前のtickから次のtickまでの経過割合（0～1，補間しないときは1）
+        戻り値：こうかとんが生き残っていればTrue，爆弾に当たったらFalse
+        """
+        prof = self.profiler
+        start = time.perf_counter()
+        if prof.active:
+            prof.begin()
+        self.renderer.begin()
+        if prof.active:
+            prof.lap("clear")  # 前のフレームのスプライトを背景で消す
+        for i in range(ticks):
+            if not self.simulate(key_lst, events if i == 0 else []):
+                return False
+        self.render(alpha)
+        if prof.active:
+            prof.end(self.counts(), self.governor.tier)
+        self.governor.update((time.perf_counter() - start)*1000)
+        return True
+
+    def simulate(self, key_lst, events: list) -> bool:
+        """
+        ゲームを1tick進める（出現・衝突判定・移動・タイマー）
+        戻り値：こうかとんが生き残っていればTrue
+        """
+        prof = self.profiler
+        lap = prof.lap if prof.active else None
+        if self.recorder is not None:
+            self.recorder.record(key_lst, events)
+        self.handle_input(key_lst, events)
+        if lap: lap("input")
+        self.spawn()
+        if lap: lap("spawn")
+        if not self.collide():
+            return False
+        if lap: lap("collision")
+        if self.interpolate:
+            self.save_positions()
+        self.update(key_lst)
+        self.tick()
+        if lap: lap("update")
+        return True
+
+    def render(self, alpha: float = 1.0):
+        """
+        スプライトと文字を描画して画面に反映する
+        引数 alpha：直前のtickから次のtickまでの経過割合
+        """
+        prof = self.profiler
+        lap = prof.lap if prof.active else None
+        self.draw(alpha)
+        if lap: lap("draw")
+        self.draw_hud()
+        prof.draw(self.renderer)
+        if lap: lap("hud")
+        self.renderer.flip()
+        if lap: lap("flip")
+
+    def save_positions(self):
+        """
+        移動する前のスプライトの位置を補間用に記録する
+        """
+        pos = {self.bird: self.bird.rect.topleft}
+        for group in (self.bosses, self.beams, self.BIG_beams, self.enhanced_image_beams,
+                      self.Strong_Beam, self.emys, self.bombs):
+            if isinstance(group, ProjectileGroup):  # 移動前の位置は配列に記録済み
+                continue
+            for spr in group:
+                pos[spr] = spr.rect.topleft
+        self.prev_pos = pos
+
+    def handle_input(self, key_lst, events: list):
+        """
+        キー入力に応じてビームを発射する
+        """
+        bird, mp = self.bird, self.mp
+        for action in self.inputs.feed(self.tmr, events):
+            if action == "profiler":  # 計測表示の切り替え
+                self.profiler.toggle()
+
+            elif action == "konami":  # 隠しコマンド：上下にも動けるようになる
+                bird.command = True
+
+            elif action == "beam" and self.tmr >= self.beam_ready:
+                self.beams.add(Beam.new(bird))
+                self.beam_ready = self.tmr + Beam.cooltime
+
+            elif action == "e" and self.tmr >= self.e_ready:  # 強化ビーム発動キー "E"
+                if mp.decrease(MP.costs["e"]):
+                    # 3方向にビームを発射
+                    for i in range(80, 101, 10):
+                        self.BIG_beams.add(BIGBeam.new(bird, big=i))
+                    self.e_ready = self.tmr + self.e_cooltime
+
+            elif action == "w":  # 強化ビーム発動キー "W"
+                if mp.decrease(MP.costs["w"]):
+                    # 5方向にビームを発射
+                    for i in range(70, 111, 10):
+                        self.enhanced_image_beams.add(EnhancedImageBeam.new(bird, angle_offset=i))
+
+            elif action == "q":  # 強化ビーム発動キー "Q"
+                if mp.decrease(MP.costs["q"]):
+                    for i in range(80, 101, 10):
+                        self.Strong_Beam.add(StrongBeam.new(bird, offset=i))
+
+    def spawn(self):
+        """
+        敵機・ボスの出現と爆弾の投下を行う
+        このtickに予約された敵機の出現と爆弾投下だけを，敵機の出現→敵機の爆弾→ボスの爆弾の順に行う
+        """
+        self.scheduler.run(self.tmr)
+
+        # ボスがいない間だけ出現するので，ボスの爆弾投下と順番を入れ替えても結果は同じ
+        if  self.score.value >= (100 + self.score_tmp) and not self.boss_spown:
+            self.boss_spown = True
+            self.add_boss(Boss())
+
+    def spawn_enemy(self, tick: int):
+        """
+        敵機を出現させ，次の出現をLv.freq tick後に予約する
+        """
+        if self.budget.admit(self.emys):
+            self.add_enemy(Enemy())
+        self.spawn_timer = self.scheduler.schedule(tick + self.lv.freq, self.spawn_enemy, (0,))
+
+    def add_enemy(self, emy: "Enemy"):
+        """
+        敵機をグループに加え，停止したら爆弾投下を予約するようにする
+        """
+        emy.order = (1, self.spawned)
+        self.spawned += 1
+        emy.on_stop = self.schedule_drop
+        self.emys.add(emy)
+        if emy.state == "stop":  # 停止した状態で加えたときはこのtickから投下できる
+            self.schedule_drop(emy, self.tmr)
+
+    def add_boss(self, boss: "Boss"):
+        """
+        ボスをグループに加え，停止したら爆弾投下を予約するようにする
+        """
+        boss.order = (2, self.spawned)
+        self.spawned += 1
+        boss.on_stop = self.schedule_drop
+        self.bosses.add(boss)
+        if boss.state == "stop":
+            self.schedule_drop(boss, self.tmr)
+
+    def schedule_drop(self, obj: "Enemy|Boss", start: int = None):
+        """
+        停止した敵機・ボスの最初の爆弾投下を予約する
+        引数1 obj：停止した敵機・ボス
+        引数2 start：投下できる最初のtick（省略時は次のtick．停止はこのtickの爆弾投下の後なので）
+        予約するのはstart以降でintervalで割り切れる最初のtick
+        """
+        if start is None:
+            start = self.tmr + 1
+        tick = -(-start//obj.interval)*obj.interval
+        self.scheduler.schedule(tick, lambda tick: self.drop_bomb(obj, tick), obj.order)
+
+    def drop_bomb(self, obj: "Enemy|Boss", tick: int):
+        """
+        敵機・ボスが爆弾を投下し，次の投下をinterval tick後に予約する
+        倒された・退場した敵機は予約を終える
+        """
+        if not obj.alive() or obj.state != "stop":
+            return
+        if isinstance(obj, Boss):
+            self.bombs.add(Bomb.new(None, obj, self.bird))
+        else:
+            self.bombs.add(Bomb.new(obj, None, self.bird))
+        self.scheduler.schedule(tick + obj.interval, lambda tick: self.drop_bomb(obj, tick), obj.order)
+
+    def explode(self, obj: "Enemy|Bomb|Boss", life: int):
+        """
+        objの位置に爆発エフェクトを出す
+        引数1 obj：爆発する敵機・爆弾・ボス
+        引数2 life：爆発時間（tick）
+        """
+        quality = self.governor.quality
+        num = self.exps.flames if isinstance(self.exps, ParticleSystem) else len(self.exps)
+        if quality.max_exps is not None and num >= quality.max_exps:  # 処理が重いときは出さない
+            return
+        life = max(1, round(life*quality.life))
+        if isinstance(self.exps, ParticleSystem):
+            self.exps.explode(obj.rect.center, life, quality.sparks)
+        else:
+            self.exps.add(Explosion.new(obj, life))
+
+    def defeat_boss(self, boss: "Boss"):
+        """
+        ボスを倒したときの処理
+        """
+        self.explode(boss, 50)  # 爆発エフェクト
+        self.score.value += 50  # 50点アップ
+        boss.kill()
+        self.score_tmp = self.score.value
+        self.boss_spown = False
+
+    def collide(self) -> bool:
+        """
+        ビーム・爆弾・敵機・ボス・こうかとんの衝突判定を行う
+        重なりは最初にまとめて求め，collision_rulesの行の順に効果を適用する
+        戻り値：こうかとんが生き残っていればTrue
+        """
+        collider = self.collider
+        groups = {name: getattr(self, name) for name in self.collision_groups}
+        pairs = [(groups[rule[0]], groups[rule[1]]) for rule in self.collision_rules]
+        for rule, (targets, shots), hits in zip(self.collision_rules, pairs, collider.contacts(pairs)):
+            _, _, destroy, kill_shot, damage, points, mp, life, cheer = rule
+            for target, found in hits:
+                if not collider.alive(targets, target):  # 前の行で消された
+                    continue
+                found = [shot for shot in found if collider.alive(shots, shot)]
+                if not found:
+                    continue
+                if kill_shot:
+                    for shot in found:
+                        collider.kill(shots, shot)
+                obj = collider.sprite(targets, target)
+                if damage and not obj.hit(damage):  # 体力が残った（弾が消えるだけ）
+                    continue
+                if destroy == "kill":
+                    collider.kill(targets, target)
+                else:
+                    getattr(self, destroy)(obj)
+                if life:
+                    self.explode(obj, life)  # 爆発エフェクト
+                self.score.value += points
+                if mp:
+                    self.mp.increase(mp)
+                if cheer:
+                    self.cheer = True  # こうかとん喜びエフェクト（移動したあとに画像を切り替える）
+        collider.finish()
+
+        return len(collider.spritecollide(self.bird, self.bombs, True)) == 0
+
+    def update(self, key_lst):
+        """
+        すべてのスプライトを移動させる
+        引数 key_lst：押下キーの真理値リスト
+        """
+        self.bosses.update()
+        for boss in self.bosses:
+            boss.update()
+        self.bird.move(key_lst)
+        if self.cheer:
+            self.bird.change_img(6)
+            self.cheer = False
+        self.beams.update()
+        self.BIG_beams.update()# 強化ビーム1の更新
+        self.enhanced_image_beams.update()  # 強化ビーム2の更新
+        self.Strong_Beam.update()
+        self.emys.update()
+        self.bombs.update()
+        self.exps.update()
+
+    def draw(self, alpha: float = 1.0):
+        """
+        すべてのスプライトと文字を描画する
+        引数 alpha：直前のtickから次のtickまでの経過割合（1なら今の位置に描く）
+        """
+        renderer = self.renderer
+        if alpha >= 1.0 or not self.interpolate:
+            draw = renderer.draw
+        else:  # 直前のtickとの間に補間して描く
+            draw = lambda group: self.draw_lerp(group, alpha)
+        draw(self.bosses)
+        bar_cache = self.governor.quality.bar_cache
+        for boss in self.bosses:
+            renderer.mark(boss.draw_hp_bar(self.screen, bar_cache))
+        draw([self.bird])
+        draw(self.beams)
+        draw(self.BIG_beams)# 強化ビーム1の描画
+        draw(self.enhanced_image_beams)  # 強化ビーム2の描画
+        draw(self.Strong_Beam)
+        draw(self.emys)
+        draw(self.bombs)
+        draw(self.exps)
+
+    def draw_lerp(self, group, alpha: float):
+        """
+        スプライトを直前のtickの位置と今の位置の間に補間して描画する
+        引数1 group：スプライトグループ（またはスプライトのリスト）
+        引数2 alpha：直前のtickから次のtickまでの経過割合
+        """
+        if isinstance(group, (ProjectileGroup, ParticleSystem)):
+            self.renderer.blits(group.blit_sequence(alpha))
+            return
+        prev = self.prev_pos
+        seq = []
+        for spr in group:
+            x, y = spr.rect.topleft
+            px, py = prev.get(spr, (x, y))  # このtickに現れたスプライトは今の位置
+            seq.append((spr.image, (px + round((x-px)*alpha), py + round((y-py)*alpha))))
+        self.renderer.blits(seq)
+
+    def draw_hud(self):
+        """
+        スコア・MP・レベルを描画する
+        """
+        # スコア・MP・レベルの文字は値が変わったときだけ作り直し，まとめて描画する
+        # 処理が重いときはhud_everyフレームごとにしか値を見ず，前の文字を描く
+        if self.hud is None or self.renderer.frames % self.governor.quality.hud_every == 0:
+            self.hud = [self.score.surface(), self.mp.surface(), self.lv.surface()]
+        self.renderer.blits(self.hud)
+
+    def tick(self):
+        """
+        レベルとタイマーを1tick進める
+        レベルが上がって出現間隔が変わったら，次の敵機の出現を予約し直す
+        """
+        freq = self.lv.freq
+        self.lv.advance(self.tmr)
+        self.tmr += 1
+        if self.lv.freq != freq:
+            self.scheduler.cancel(self.spawn_timer)
+            tick = -(-self.tmr//self.lv.freq)*self.lv.freq  # 今のtick以降で出現間隔で割り切れる最初のtick
+            self.spawn_timer = self.scheduler.schedule(tick, self.spawn_enemy, (0,))
+
+    def show_defeat(self):
+        """
+        こうかとんがやられた画面を表示する
+        """
+        self.bird.change_img(8) # こうかとん悲しみエフェクト
+        self.screen.blit(self.bird.image, self.bird.rect)
+        self.score.update(self.screen)
+        pg.display.update()
+
+    def counts(self) -> dict:
+        """
+        各スプライトグループの数を辞書で返す
+        """
+        return {
+            "emys": len(self.emys),
+            "bosses": len(self.bosses),
+            "bombs": len(self.bombs),
+            "beams": len(self.beams) + len(self.BIG_beams) + len(self.enhanced_image_beams) + len(self.Strong_Beam),
+            "exps": len(self.exps),
+        }
+
+
+def configure_pools(size: int):
+    """
+    ビーム・爆弾・爆発のプールを作り直す
+    引数 size：クラスごとに取っておくスプライトの最大数（0ならプールしない）
+    """
+    for cls in (Beam, BIGBeam, EnhancedImageBeam, StrongBeam, Bomb, Explosion):
+        cls.pool = SpritePool(cls, size) if size > 0 else None
+
+
+def pool_stats() -> dict:
+    """
+    プールの統計をクラス名→統計の辞書で返す
+    """
+    return {cls.__name__: cls.pool.stats()
+            for cls in (Beam, BIGBeam, EnhancedImageBeam, StrongBeam, Bomb, Explosion)
+            if cls.pool is not None}
+
+
+configure_pools(256)
+
+
+class KeyState:
+    """
+    pg.key.get_pressed()の代わりに使う押下キーの状態
+    押されているキーの集合を持ち，キー定数で引くと真理値を返す
+    """
+    def __init__(self, held=()):
+        self.held = frozenset(held)
+
+    def __getitem__(self, key: int) -> bool:
+        return key in self.held
+
+
+class ScriptedInput:
+    """
+    画面なしのシミュレーションにキー入力を与えるクラス
+    フレームごとの押下キー集合から，KeyStateと新しく押されたキーのKEYDOWNイベントを作る
+    """
+    keynames = {
+        "left": pg.K_LEFT, "right": pg.K_RIGHT, "up": pg.K_UP, "down": pg.K_DOWN,
+        "space": pg.K_SPACE, "e": pg.K_e, "w": pg.K_w, "q": pg.K_q, "b": pg.K_b, "a": pg.K_a,
+    }
+
+    def __init__(self, policy):
+        """
+        引数 policy：(フレーム番号, Game)を受け取り押下キーの集合を返す関数
+        """
+        self.policy = policy
+        self.held = frozenset()
+
+    def poll(self, frame: int, game: "Game") -> tuple[KeyState, list]:
+        """
+        1フレーム分の入力を返す
+        戻り値：(KeyState, KEYDOWNイベントのリスト)
+        """
+        held = frozenset(self.policy(frame, game))
+        events = [pg.event.Event(pg.KEYDOWN, key=key) for key in sorted(held - self.held)]
+        self.held = held
+        return KeyState(held), events
+
+    @classmethod
+    def from_file(cls, path: str) -> "ScriptedInput":
+        """
+        入力スクリプトファイルを読み込む
+        1行に「フレーム番号 キー名 キー名 ...」を書くと，そのフレームから次の行までキーを押し続ける
+        （キー名：left right up down space e w q b a，#以降はコメント）
+        """
+        script = []
+        with open(path, "r", encoding="utf-8") as rf:
+            for line in rf:
+                words = line.split("#")[0].split()
+                if words:
+                    script.append((int(words[0]), frozenset(cls.keynames[w] for w in words[1:])))
+        script.sort(key=lambda item: item[0])
+
+        def policy(frame, game):
+            held = frozenset()
+            for start, keys in script:
+                if start > frame:
+                    break
+                held = keys
+            return held
+        return cls(policy)
+
+
+def bot_policy(seed: int):
+    """
+    左右に動き回りながらビームを撃つ簡単なボットの入力関数を返す
+    ゲーム本体の乱数とは別の乱数列を使うので，ゲームの乱数列を乱さない
+    引数 seed：ボットの乱数シード
+    """
+    rng = random.Random(seed)
+    state = {"move": None, "until": 0}
+
+    def policy(frame, game):
+        if frame >= state["until"]:
+            state["move"] = rng.choice([pg.K_LEFT, pg.K_RIGHT, None])
+            state["until"] = frame + rng.randint(10, 40)
+        held = set()
+        if state["move"] is not None:
+            held.add(state["move"])
+        if frame % 2 == 0:
+            held.add(pg.K_SPACE)
+        if frame % 50 == 0:
+            held.add(rng.choice([pg.K_e, pg.K_w, pg.K_q]))
+        return held
+    return policy
+
+
+def write_varint(buf: bytearray, num: int):
+    """
+    0以上の整数を可変長（7ビットずつ，最上位ビットが続きの印）でbufに追記する
+    """
+    while num >= 0x80:
+        buf.append(num & 0x7F | 0x80)
+        num >>= 7
+    buf.append(num)
+
+
+def read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    """
+    write_varintで書いた整数をdataのposから読む
+    戻り値：(整数, 次の位置)
+    """
+    num = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        num |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return num, pos
+        shift += 7
+
+
+class InputRecorder:
+    """
+    1ゲーム分のキー入力をtickごとに記録し，リプレイファイルへ少しずつ書き出すクラス
+    ファイルはヘッダ（乱数シードと敵機の上限の設定）のあとに，入力が変わったtickだけを
+    (変わらなかったtick数, 押下キーのビットマスクの差分, 押されたキーの並び)の形で並べ，zlibで圧縮する
+    """
+    magic = b"KKRP"
+    version = 1
+    keys = list(ScriptedInput.keynames.values())  # ビット番号→キー定数
+    end_mark = 0x7F  # 押されたキーの数の代わりに書く記録の終わりの印（押されたキーの数はこれより小さい）
+    flush_ticks = 10*Game.tick_rate  # ゲームの時間でこのtick数ごとに圧縮途中のデータをファイルへ書き出す
+
+    def __init__(self, path: str, seed: int, budget: EnemyBudget):
+        """
+        引数1 path：リプレイファイル
+        引数2 seed：ゲーム開始時の乱数シード
+        引数3 budget：記録するゲームの敵機の数の上限
+        """
+        self.path = path
+        self.seed = seed
+        self.bits = {key: 1 << i for i, key in enumerate(self.keys)}
+        self.file = open(path, "wb")
+        self.zip = zlib.compressobj(9)
+        self.held = 0  # 直前のtickの押下キーのビットマスク
+        self.run = 0  # 入力が変わらないまま続いているtick数
+        self.ticks = 0
+        self.records = 0
+        self.flushed = 0  # 最後にファイルへ書き出したtick
+        head = bytearray(self.magic)
+        head.append(self.version)
+        write_varint(head, seed)
+        write_varint(head, budget.limit)
+        head.append(EnemyBudget.policies.index(budget.policy))
+        self.file.write(head)
+
+    def record(self, key_lst, events: list):
+        """
+        1tick分の入力を記録する
+        引数1 key_lst：押下キーの状態
+        引数2 events：このtickで処理するイベントのリスト
+        """
+        held = 0
+        for key, bit in self.bits.items():
+            if key_lst[key]:
+                held |= bit
+        pressed = [self.keys.index(event.key) for event in events
+                   if event.type == pg.KEYDOWN and event.key in self.bits]
+        self.ticks += 1
+        if held == self.held and not pressed:
+            self.run += 1
+            return
+        if len(pressed) >= self.end_mark:
+            raise ValueError(f"1tickに押されたキーが多すぎます（{len(pressed)}個，{self.end_mark - 1}個まで）")
+        buf = bytearray()
+        write_varint(buf, self.run)
+        write_varint(buf, held ^ self.held)
+        buf.append(len(pressed))
+        buf += bytes(pressed)
+        self.write(buf)
+        self.held = held
+        self.run = 0
+
+    def write(self, buf: bytearray):
+        """
+        記録を圧縮して書き出し，flush_ticksごとにファイルへ吐き出す（途中で落ちてもそこまでは再生できる）
+        吐き出すたびに圧縮のブロックが切れて大きくなるので，記録の数ではなくゲームの時間で間隔を決める
+        """
+        self.file.write(self.zip.compress(bytes(buf)))
+        self.records += 1
+        if self.ticks - self.flushed >= self.flush_ticks:
+            self.file.write(self.zip.flush(zlib.Z_SYNC_FLUSH))
+            self.file.flush()
+            self.flushed = self.ticks
+
+    def close(self, game: "Game" = None):
+        """
+        残りの入力と終わりの印（最終スコアとtick数）を書いてファイルを閉じる
+        引数 game：記録したゲーム（再生結果の確認用）
+        """
+        if self.file is None:
+            return
+        buf = bytearray()
+        if self.run:  # 最後の変化のあとの入力なしのtick
+            write_varint(buf, self.run - 1)
+            buf += b"\x00\x00"
+        write_varint(buf, 0)
+        write_varint(buf, 0)
+        buf.append(self.end_mark)
+        write_varint(buf, game.score.value if game is not None else 0)
+        write_varint(buf, game.tmr if game is not None else self.ticks)
+        self.file.write(self.zip.compress(bytes(buf)))
+        self.file.write(self.zip.flush())
+        self.file.close()
+        self.file = None
+
+
+class ReplayInput(ScriptedInput):
+    """
+    InputRecorderで記録したリプレイファイルを読み，tickごとの入力をScriptedInputと同じ形で返すクラス
+    """
+    def __init__(self, path: str):
+        """
+        引数 path：リプレイファイル
+        """
+        super().__init__(None)
+        with open(path, "rb") as rf:
+            data = rf.read()
+        magic = InputRecorder.magic
+        if data[:len(magic)] != magic or data[len(magic)] != InputRecorder.version:
+            raise ValueError(f"{path}はリプレイファイルではありません")
+        pos = len(magic) + 1
+        self.seed, pos = read_varint(data, pos)
+        limit, pos = read_varint(data, pos)
+        self.budget = EnemyBudget(limit, EnemyBudget.policies[data[pos]])
+        # 途中で書き込みが止まったファイルでも，読めたところまでを再生する
+        self.data = zlib.decompressobj().decompress(data[pos + 1:])
+        self.score = None  # 記録したゲームの最終スコア（終わりの印がなければNone）
+        self.ticks = None
+        self.timeline = self.decode()
+        self.done = False
+
+    def decode(self):
+        """
+        tickごとの(押下キーの集合, 押されたキーのリスト)を順に返すジェネレータ
+        """
+        data = self.data
+        pos = 0
+        held = 0
+        try:
+            while pos < len(data):
+                run, pos = read_varint(data, pos)
+                for _ in range(run):
+                    yield held, ()
+                change, pos = read_varint(data, pos)
+                count = data[pos]
+                pos += 1
+                if count == InputRecorder.end_mark:
+                    self.score, pos = read_varint(data, pos)
+                    self.ticks, pos = read_varint(data, pos)
+                    return
+                held ^= change
+                yield held, data[pos:pos + count]
+                pos += count
+        except IndexError:  # 記録の途中で切れている
+            return
+
+    def poll(self, frame: int, game: "Game") -> tuple[KeyState, list]:
+        """
+        1tick分の入力を返す．記録が終わったらdoneをTrueにして何も押さない入力を返す
+        戻り値：(KeyState, KEYDOWNイベントのリスト)
+        """
+        keys = InputRecorder.keys
+        item = next(self.timeline, None)
+        if item is None:
+            self.done = True
+            return KeyState(), []
+        held, pressed = item
+        return (KeyState(key for i, key in enumerate(keys) if held >> i & 1),
+                [pg.event.Event(pg.KEYDOWN, key=keys[i]) for i in pressed])
+
+
+def run_headless(frames: int, seed: int = 0, inputs: ScriptedInput = None, render_mode: str = "dirty",
+                 profiler: FrameProfiler = None, projectiles: str = "sprite", record: str = None,
+                 budget: EnemyBudget = None, frame_budget: float = 20.0) -> dict:
+    """
+    画面を表示せずにゲームを最高速度で動かし，結果を辞書で返す
+    こうかとんがやられたら次のゲームを始め，合計framesフレームまで続ける
+    引数1 frames：シミュレーションするフレーム数
+    引数2 seed：乱数シード
+    引数3 inputs：キー入力（省略時はボット）
+    引数4 render_mode：描画方式
+    引数5 profiler：フレーム計測
+    引数6 projectiles：ビーム・爆弾の持ち方（"sprite"または"numpy"）
+    引数7 record：最初のゲームの入力を記録するリプレイファイル（省略時は記録しない）
+    引数8 budget：敵機の数の上限（省略時は上限なし，全ゲームで同じものを使い上限が効いた回数を合計する）
+    引数9 frame_budget：1フレームの処理時間の予算（ミリ秒，ゲームごとにFrameGovernorを作る）
+    """
+    screen = pg.display.get_surface()
+    if screen is None:
+        screen = pg.display.set_mode((WIDTH, HEIGHT))
+    preload_assets()
+    random.seed(seed)
+    if inputs is None:
+        inputs = ScriptedInput(bot_policy(seed))
+    if budget is None:
+        budget = EnemyBudget()
+    game = Game(screen, render_mode, profiler, projectiles, budget, FrameGovernor(frame_budget))
+    if record:
+        game.recorder = InputRecorder(record, seed, budget)
+    scores = []
+    peak = game.counts()
+    trend = {name: [] for name in peak}  # グループ名→ゲーム内1分ごとの最大数
+    gc_before = sum(stat["collections"] for stat in gc.get_stats())
+    renders_before = HudText.render_calls
+    start = time.perf_counter()
+    for frame in range(frames):
+        pg.event.pump()
+        key_lst, events = inputs.poll(frame, game)
+        if not game.step(key_lst, events):
+            scores.append(game.score.value)
+            if game.recorder is not None:
+                game.recorder.close(game)
+            game = Game(screen, render_mode, profiler, projectiles, budget, FrameGovernor(frame_budget))
+        minute = frame // (60*Game.tick_rate)
+        for name, num in game.counts().items():
+            peak[name] = max(peak[name], num)
+            if len(trend[name]) <= minute:
+                trend[name].append(num)
+            trend[name][minute] = max(trend[name][minute], num)
+    elapsed = time.perf_counter() - start
+    if game.recorder is not None:
+        game.recorder.close(game)
+    return {
+        "frames": frames,
+        "seconds": elapsed,
+        "fps": frames/elapsed if elapsed else 0.0,
+        "seed": seed,
+        "deaths": len(scores),
+        "scores": scores,
+        "score": game.score.value,
+        "counts": game.counts(),
+        "peak_counts": peak,
+        "counts_per_minute": trend,
+        "enemy_budget": game.budget.stats(),
+        "frame_governor": game.governor.stats(),
+        "gc_collections": sum(stat["collections"] for stat in gc.get_stats()) - gc_before,
+        "hud_render_calls": HudText.render_calls - renders_before,
+        "hud_renders_per_game_second": (HudText.render_calls - renders_before)/(frames/Game.tick_rate),
+        "pools": pool_stats(),
+    }
+
+
+def run_replay(path: str, render: bool = False, render_mode: str = "dirty",
+               profiler: FrameProfiler = None, projectiles: str = "sprite", frame_budget: float = 20.0) -> dict:
+    """
+    リプレイファイルの入力でゲームを1回分動かし，結果を辞書で返す
+    同じファイルからは毎回同じゲームになるので，性能計測の決まった負荷としても使える
+    引数1 path：リプレイファイル
+    引数2 render：Trueなら1秒にGame.tick_rate回の速さで画面に表示し，Falseなら最高速度で動かす
+    引数3 render_mode：描画方式
+    引数4 profiler：フレーム計測
+    引数5 projectiles：ビーム・爆弾の持ち方（"sprite"または"numpy"）
+    引数6 frame_budget：1フレームの処理時間の予算（ミリ秒）
+    """
+    replay = ReplayInput(path)
+    screen = pg.display.get_surface()
+    if screen is None:
+        screen = pg.display.set_mode((WIDTH, HEIGHT))
+    if render:
+        pg.display.set_caption(f"こうかとんインベーダー（リプレイ：{os.path.basename(path)}）")
+    preload_assets()
+    random.seed(replay.seed)
+    game = Game(screen, render_mode, profiler, projectiles, replay.budget, FrameGovernor(frame_budget))
+    clock = pg.time.Clock()
+    times = []
+    alive = True
+    start = time.perf_counter()
+    while True:
+        if render:
+            if any(event.type == pg.QUIT for event in pg.event.get()):
+                break
+        else:
+            pg.event.pump()
+        key_lst, events = replay.poll(game.tmr, game)
+        if replay.done:
+            break
+        begin = time.perf_counter()
+        alive = game.step(key_lst, events)
+        times.append(time.perf_counter() - begin)
+        if not alive:
+            break
+        if render:
+            clock.tick(Game.tick_rate)
+    elapsed = time.perf_counter() - start
+    left = sum(1 for _ in replay.timeline)  # やられたあとに残った入力（最後まで読んで記録の結果を得る）
+    times.sort()
+    return {
+        "replay": path,
+        "seed": replay.seed,
+        "ticks": game.tmr,
+        "seconds": elapsed,
+        "fps": len(times)/elapsed if elapsed else 0.0,
+        "frame_ms_p50": times[len(times)//2]*1000 if times else 0.0,
+        "frame_ms_p99": times[len(times)*99//100]*1000 if times else 0.0,
+        "alive": alive,
+        "unplayed_ticks": left,
+        "score": game.score.value,
+        "recorded_score": replay.score,
+        "matches_recording": None if replay.score is None else (replay.score, replay.ticks) == (game.score.value, game.tmr),
+        "enemy_budget": game.budget.stats(),
+        "frame_governor": game.governor.stats(),
+    }
+
+
+def atlas_keys() -> list:
+    """
+    ゲーム中に使う画像と加工済み画像の(ファイル名, 加工手順タプル)のリストを返す（アトラスに詰め込むもの）
+    """
+    keys = []
+    for num in (3, 6, 8):
+        keys += Bird.image_keys(num).values()
+    keys.append(("beam.png", (("rotozoom", 90.0, 0.8),)))
+    for i in range(70, 111, 10):
+        keys.append(("beam.png", (("scale", (50, 50)), ("rotate", i))))
+        keys.append(("beam.png", (("scale", (200, 50)), ("rotate", i))))
+    keys += [("explosion.gif", ()), ("explosion.gif", (("flip", 1, 1),))]
+    keys += ParticleSystem.frame_keys()
+    keys += Enemy.image_keys + Boss.image_keys
+    keys.append(("9.png", (("rotozoom", 0, 1.0),)))
+    return list(dict.fromkeys(keys))
+
+
+def preload_assets(cache: str = ""):
+    """
+    ゲーム中に使う画像と加工済み画像をすべて先読みする
+    加工済み画像はアトラスのページにまとめ，キャッシュファイルがあれば加工せずに読み込む
+    これ以降のゲーム中にはディスクからの読み込みが発生しない
+    引数 cache：アトラスのキャッシュファイル（省略時・空文字ならキャッシュを使わない）
+    画面なしの実行・ベンチマーク・バランス調査からはソースのディレクトリにファイルを作らないよう省略して呼ぶ
+    """
+    atlas.prepare(atlas_keys(), ["pg_bg.jpg"], cache)
+    Enemy.load_images()
+    Boss.load_images()
+    Bomb.build_atlas()
+    if np is not None:
+        ParticleSystem.load_frames()
+
+
+def wait_events(timeout: int = 1000) -> list:
+    """
+    イベントが来るまでCPUを使わずに待ち，溜まっているイベントをすべて返す
+    引数 timeout：待つ最大時間（ミリ秒），時間切れなら空のリストを返す
+    """
+    event = pg.event.wait(timeout)
+    if event.type == pg.NOEVENT:
+        return []
+    return [event] + pg.event.get()
+
+
+def enter_name(screen: pg.Surface, menu: "MenuScreen", selection_index: int) -> Union[str, None]:
+    """
+    名前入力モード：Enterが押されるまで入力された文字を名前として受け付ける
+    入力中の名前はスタート画面に表示する
+    戻り値：入力された名前（ウィンドウが閉じられたらNone）
+    """
+    txt_words = []
+    menu.set_text("name", "Name : ")
+    menu.draw(screen, selection_index)
+    pg.display.update()
+    while True:
+        for event in wait_events():
+            ###囲われた部分は引用###
+            if event.type == pg.QUIT:
+                return None
+            if event.type == pg.KEYDOWN:  # キー入力検知？
+                if event.key == pg.K_RETURN:  # Enter押下？
+                    return ''.join(txt_words)  # 文字列に直して返す
+                elif event.key == pg.K_BACKSPACE:  # BackSpace押下？
+                    if not len(txt_words) == 0:  # 保持している文字が存在するか？
+                        txt_words.pop()  # 最後の文字を取り出す(削除)
+                else:  # 上記以外のキーが押された時
+                    txt_tmp = jud_key(event.key)
+                    if not txt_tmp == None:  # 入力可能な文字？
+                        txt_words.append(txt_tmp)  # 入力可能であれば保持する
+            ######################
+                menu.set_text("name", f"Name : {''.join(txt_words)}")
+                menu.draw(screen, selection_index)
+                pg.display.update()
+
+
+class ScreenMeter:
+    """
+    画面（flag）ごとに経過時間とCPU時間を集計し，CPU使用率を求めるクラス
+    """
+    def __init__(self):
+        self.wall = collections.defaultdict(float)  # 画面名→経過時間（秒）
+        self.cpu = collections.defaultdict(float)  # 画面名→CPU時間（秒）
+        self.current = None
+
+    def enter(self, name: str):
+        """
+        画面nameに入ったことを記録する（それまでの画面の時間を集計する）
+        """
+        now_wall, now_cpu = time.perf_counter(), time.process_time()
+        if self.current is not None:
+            self.wall[self.current] += now_wall - self.start_wall
+            self.cpu[self.current] += now_cpu - self.start_cpu
+        self.current = name
+        self.start_wall, self.start_cpu = now_wall, now_cpu
+
+    def report(self) -> dict:
+        """
+        画面名→(経過時間, CPU時間, CPU使用率%)の辞書を返す
+        """
+        self.enter(self.current)
+        return {name: (self.wall[name], self.cpu[name], 100*self.cpu[name]/self.wall[name] if self.wall[name] else 0.0)
+                for name in self.wall}
+
+
+class StartupTimer:
+    """
+    起動から最初の画面を表示するまでの段階ごとの経過時間を記録するクラス
+    """
+    def __init__(self, start: tuple[float, float]):
+        """
+        引数 start：計測を始める時刻とそのときのCPU時間（time.perf_counter(), time.process_time()）
+        """
+        self.start, self.cpu_before = start  # cpu_before：それまで（Pythonとpygameの起動）に使ったCPU時間
+        self.last = self.start
+        self.phases = []  # (段階名, 秒, 補足)
+        self.done = False
+
+    def mark(self, name: str, detail: str = ""):
+        """
+        前の段階の終わりから今までを段階nameの時間として記録する
+        """
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last, detail))
+        self.last = now
+
+    def report(self) -> str:
+        """
+        段階ごとの時間を1行の文字列にする
+        """
+        parts = [f"before import {self.cpu_before*1000:.1f} ms cpu"]
+        for name, sec, detail in self.phases:
+            parts.append(f"{name} {sec*1000:.1f} ms" + (f" ({detail})" if detail else ""))
+        parts.append(f"total {(self.last - self.start)*1000:.1f} ms")
+        return "startup: " + " | ".join(parts)
+
+
+startup = StartupTimer(IMPORT_START)
+
+
+def main(asset_stats: bool = False, render_mode: str = "dirty", render_stats: bool = False,
+         profiler: FrameProfiler = None, meter: ScreenMeter = None, fps: int = 50,
+         projectiles: str = "sprite", rank_store: str = "sqlite", record: str = None,
+         startup_stats: bool = False, budget: EnemyBudget = None, frame_budget: float = 20.0):
     pg.display.set_caption("こうかとんインベーダー")
     screen = pg.display.set_mode((WIDTH, HEIGHT))
+    startup.mark("display")
+    preload_assets(ATLAS_CACHE)
+    startup.mark("assets", atlas.source)
+    if asset_stats:
+        print(f"assets preloaded: {assets.stats()}")
+        print(f"atlas: {atlas.stats()}")
+    if meter is None:
+        meter = ScreenMeter()
     flag = "start" #画面推移の管理
-    rank = Scorerank("kokaton_invader_score.txt") #ファイルパスを渡してランクの作成
+    games = 0  # 始めたゲームの数（2回目以降の記録ファイル名に付ける）
+    rank = open_rank(rank_store)
+    startup.mark("ranking")
     txt_give = "NoName"
+    # メニュー画面は一度だけ作り，変わった文字だけ作り直す
+    start_menu = MenuScreen(["start", "rank"])
+    start_menu.add("title", "kokaton invader", 80, (WIDTH // 2, 200)) #タイトルテキストの作成
+    start_menu.add("start", "start", 60, (WIDTH // 2, HEIGHT // 2)) #スタートテキストの作成
+    start_menu.add("rank", "ranking", 60, (WIDTH // 2, HEIGHT // 2 + 60)) #ランキングテキストの作成
+    start_menu.add("name", f"Name : {txt_give}", 60, (WIDTH // 2, HEIGHT // 2 -100))
+    rank_menu = MenuScreen()
+    rank_menu.add("title", "RANKING", 60, (WIDTH // 2, 80))
+    rank_menu.add("home", "home[h]", 60, (WIDTH // 2, 690))
+    rank_menu.add("page", "", 36, (WIDTH // 2, 645))
+    for i in range(Scorerank.size):
+        rank_menu.add(f"No.{i+1}", "", 50, (WIDTH // 2, 150 + i*50 ))
+    over_menu = MenuScreen(["start", "home"])
+    over_menu.add("hiscore", "", 50, (WIDTH // 2, 250))
+    over_menu.add("score", "", 80, (WIDTH // 2, 200))
+    over_menu.add("start", "start", 60, (WIDTH // 2, HEIGHT // 2)) #スタートテキストの作成
+    over_menu.add("home", "home", 60, (WIDTH // 2, HEIGHT // 2 + 60)) #ホームテキストの作成
+    startup.mark("menus")
     while True:
         if flag =="start":
-            bg_img = pg.image.load(f"fig/pg_bg.jpg") #背景画像の読み込み
-            txts = pg.sprite.Group()
-            title_text = Fontdraw(f"kokaton invader", 80, (WIDTH // 2, 200)) #タイトルテキストの作成
-            start_text = Fontdraw("start", 60, (WIDTH // 2, HEIGHT // 2)) #スタートテキストの作成
-            rank_text = Fontdraw("ranking", 60, (WIDTH // 2, HEIGHT // 2 + 60)) #ランキングテキストの作成
-            name_text = Fontdraw(f"Name : {txt_give}", 60, (WIDTH // 2, HEIGHT // 2 -100))
-            txts.add(title_text)
-            txts.add(start_text)
-            txts.add(rank_text)
-            txts.add(name_text)
-            img = pg.image.load("fig/9.png") #選択用画像の読み込み
-            img = pg.transform.rotozoom(img, 0, 1.0) #画像サイズの設定
-            img_rect = img.get_rect()
+            meter.enter("start")
+            start_menu.set_text("name", f"Name : {txt_give}")
             selection_index = 0
-            options = [start_text, rank_text] #メニュー項目のオプションリストの設定
-            while True:
-                screen.blit(bg_img, [0, 0]) #背景画像の描写
-                txts.draw(screen)
-                selected_text = options[selection_index % len(options)] #現在の選択項目に画像を配置
-                img_rect.right = selected_text.rect.left - 10
-                img_rect.centery = selected_text.rect.centery
-                screen.blit(img, img_rect)
-                pg.display.update() #画像を更新
-                for event in pg.event.get():
+            options = start_menu.options #メニュー項目のオプションリストの設定
+            redraw = True
+            while flag == "start":
+                if redraw:  # 選択や名前が変わったときだけ描き直す
+                    start_menu.draw(screen, selection_index)
+                    pg.display.update() #画像を更新
+                    redraw = False
+                    if not startup.done:  # 最初の画面を表示するまでの時間
+                        startup.mark("first frame")
+                        startup.done = True
+                        if startup_stats:
+                            print(startup.report())
+                for event in wait_events():
                     if event.type == pg.QUIT:
                         return 0
                     elif event.type == pg.KEYDOWN:
+                        redraw = True
                         if event.key == pg.K_UP:
                             selection_index = (selection_index - 1) % len(options) #上矢印キーで選択を上に移動
                         elif event.key == pg.K_DOWN:
@@ -615,86 +3529,63 @@ def main():
                             elif selection_index % len(options) == 1:
                                 flag = "rank" #インデックスが1の時ランキング表示
                             break
-                key_lst = pg.key.get_pressed()
-                if key_lst[pg.K_LSHIFT]:
-                    txt_words = []
-                    txt_tmp = ""
-                    is_txts = True
-                    while is_txts:
-                        key_lst = pg.key.get_pressed()
-                        for event in pg.event.get():
-                            ###囲われた部分は引用###
-                            if event.type == pg.QUIT:
+                        elif event.key == pg.K_LSHIFT:  # 名前入力モード
+                            name = enter_name(screen, start_menu, selection_index)
+                            if name is None:
                                 return 0
-                            if event.type == pg.KEYDOWN:  # キー入力検知？
-                                if event.key == pg.K_RETURN:  # Enter押下？
-                                    txt_give = ''.join(txt_words)  # 文字列に直して保持
-                                    is_txts = False
-                                    break
-                                elif event.key == pg.K_BACKSPACE:  # BackSpace押下？
-                                    if not len(txt_words) == 0:  # 保持している文字が存在するか？
-                                        txt_words.pop()  # 最後の文字を取り出す(削除)
-                                elif event.type == pg.QUIT:
-                                    return 0
-                                else:  # 上記以外のキーが押された時
-                                    txt_tmp = jud_key(event.key)
-                                    if not txt_tmp == None:  # 入力可能な文字？
-                                        txt_words.append(txt_tmp)  # 入力可能であれば保持する
-                            ######################
-                    else:
-                        break
-
-                if flag == "game" or flag == "rank":
-                    break
+                            txt_give = name
+                            start_menu.set_text("name", f"Name : {txt_give}")
             continue
         
         if flag == "rank": #ランク画面なら
-            screen = pg.display.set_mode((WIDTH, HEIGHT))
-            bg_img = pg.image.load(f"fig/pg_bg.jpg")
-            txts = pg.sprite.Group()
-            txts.add(Fontdraw("RANKING", 60, (WIDTH // 2, 80)))
-            txts.add(Fontdraw("home[h]", 60, (WIDTH // 2, 680)))
-            for i, score in enumerate(rank.ranklst): #ランキングの表示
-                txts.add(Fontdraw(f"No.{i+1} : {rank.namelst[i]} {score}", 50, (WIDTH // 2, 150 + i*50 )))
-            screen.blit(bg_img, [0, 0])
-            txts.draw(screen)
-            pg.display.update()
-            while True:
-                key_lst = pg.key.get_pressed()
-                for event in pg.event.get():
+            meter.enter("rank")
+            total = rank.count()
+            pages = max(1, -(-total//Scorerank.size))
+            page = 0
+            redraw = True
+            while flag == "rank":  # ページを変えたときだけ1ページ分を読み出して描き直す
+                if redraw:
+                    rows = rank.page(page*Scorerank.size, Scorerank.size)
+                    for i in range(Scorerank.size): #ランキングの表示
+                        if i < len(rows):
+                            score, name = rows[i]
+                            rank_menu.set_text(f"No.{i+1}", f"No.{page*Scorerank.size+i+1} : {name} {score}")
+                        else:
+                            rank_menu.set_text(f"No.{i+1}", "")
+                    rank_menu.set_text("page", f"< {page+1}/{pages} >" if pages > 1 else "")
+                    rank_menu.draw(screen)
+                    pg.display.update()
+                    redraw = False
+                for event in wait_events():
                     if event.type == pg.QUIT:
                         return 0
-                if key_lst[pg.K_h]:
-                    flag = "start"
-                    break 
+                    if event.type == pg.KEYDOWN and event.key == pg.K_h:
+                        flag = "start"
+                        break
+                    if event.type == pg.KEYDOWN and event.key in (pg.K_LEFT, pg.K_RIGHT):  # ページ送り
+                        new_page = page + (1 if event.key == pg.K_RIGHT else -1)
+                        if 0 <= new_page < pages:
+                            page = new_page
+                            redraw = True
+            continue
 
         if flag =="gameover":
-            bg_img = pg.image.load(f"fig/pg_bg.jpg") #背景画像の読み込み
-            txts = pg.sprite.Group()
-            txts.add(Fontdraw(f"HiScore : {rank.ranklst[0]}", 50, (WIDTH // 2, 250))) 
-            score_text = Fontdraw(f"Score:{score.value}", 80, (WIDTH // 2, 200))
-            start_text = Fontdraw("start", 60, (WIDTH // 2, HEIGHT // 2)) #スタートテキストの作成
-            home_text = Fontdraw("home", 60, (WIDTH // 2, HEIGHT // 2 + 60)) #ホームテキストの作成
-            txts.add(score_text)
-            txts.add(start_text)
-            txts.add(home_text)
-            img = pg.image.load("fig/9.png") #選択用画像の読み込み
-            img = pg.transform.rotozoom(img, 0, 1.0)
-            img_rect = img.get_rect()
+            meter.enter("gameover")
+            over_menu.set_text("hiscore", f"HiScore : {rank.ranklst[0]}")
+            over_menu.set_text("score", f"Score:{score.value}")
             selection_index = 0
-            options = [start_text, home_text] #メニュー項目のオプションリストの設定
-            while True:
-                screen.blit(bg_img, [0, 0])
-                txts.draw(screen)
-                selected_text = options[selection_index % len(options)] #現在の選択項目に画像を配置
-                img_rect.right = selected_text.rect.left - 10
-                img_rect.centery = selected_text.rect.centery
-                screen.blit(img, img_rect)
-                pg.display.update()
-                for event in pg.event.get():
+            options = over_menu.options #メニュー項目のオプションリストの設定
+            redraw = True
+            while flag == "gameover":
+                if redraw:
+                    over_menu.draw(screen, selection_index)
+                    pg.display.update()
+                    redraw = False
+                for event in wait_events():
                     if event.type == pg.QUIT:
                         return 0
                     elif event.type == pg.KEYDOWN:
+                        redraw = True
                         if event.key == pg.K_UP:
                             selection_index = (selection_index - 1) % len(options) #上矢印キーで選択を上に移動
                         elif event.key == pg.K_DOWN:
@@ -705,199 +3596,145 @@ def main():
                             elif selection_index % len(options) == 1:
                                 flag = "start" #インデックスが1の時スタート画面に戻る
                             break
-                if flag == "game" or flag == "start":
-                    break
             continue
 
         if flag == "game":
-            bg_img = pg.image.load(f"fig/pg_bg.jpg")
-            score = Score()
-            lv = Lv()
-            mp = MP()  # MPインスタンスの作成
-            boss_spown = False  # ボスの出現判定
-            score_tmp = 0
-            e_cooltime = 0
-            
-            bird = Bird(3, (325, 650))
-            bombs = pg.sprite.Group()
-            beams = pg.sprite.Group()
-            BIG_beams =pg.sprite.Group()
-            enhanced_image_beams = pg.sprite.Group()
-            Strong_Beam = pg.sprite.Group()
-            exps = pg.sprite.Group()
-            emys = pg.sprite.Group()
-            bosses = pg.sprite.Group()
-
-            tmr = 0
-            command1 = False
+            meter.enter("game")
+            if record:  # 乱数シードを決めてから始め，入力と一緒に記録する
+                seed = int.from_bytes(os.urandom(4), "little")
+                random.seed(seed)
+            game = Game(screen, render_mode, profiler, projectiles, budget, FrameGovernor(frame_budget))
+            game.interpolate = fps != Game.tick_rate
+            if record:
+                games += 1
+                root, ext = os.path.splitext(record)
+                game.recorder = InputRecorder(record if games == 1 else f"{root}-{games}{ext}", seed, game.budget)
             clock = pg.time.Clock()
-
-
+            tick_ms = 1000 / Game.tick_rate
+            acc = tick_ms  # 最初のフレームで1tick進める
+            pending = []  # まだtickで処理していないイベント
+            last = time.perf_counter()
             while True:
-                key_lst = pg.key.get_pressed()
-                check_konami_command(key_lst)
-                for event in pg.event.get():
+                events = pg.event.get()
+                for event in events:
                     if event.type == pg.QUIT:
+                        if game.recorder is not None:
+                            game.recorder.close(game)
                         return 0
-                    if event.type == pg.KEYDOWN and event.key == pg.K_SPACE and Beam.cooltime == 0:
-                        beams.add(Beam(bird))
-
-                    if event.type == pg.KEYDOWN and event.key == pg.K_e and e_cooltime <=0:  # 強化ビーム発動キー "E"
-                        if mp.decrease(1): 
-                            # 3方向にビームを発射
-                            for i in range(80, 101, 10):
-                                BIG_beams.add(BIGBeam(bird, big=i))
-                            e_cooltime = 20
-
-                    if event.type == pg.KEYDOWN and event.key == pg.K_w:  # 強化ビーム発動キー "W"
-                        if mp.decrease(5): 
-                            # 5方向にビームを発射
-                            for i in range(70, 111, 10):
-                                enhanced_image_beams.add(EnhancedImageBeam(bird, angle_offset=i))
-
-                    if event.type == pg.KEYDOWN and event.key == pg.K_q:  # 強化ビーム発動キー "Q"
-                        if mp.decrease(7): 
-                            for i in range(80, 101, 10):
-                                Strong_Beam.add(StrongBeam(bird, offset=i))
-                screen.blit(bg_img, [0, 0])
-
-                if tmr%lv.freq == 0:
-                    emys.add(Enemy())
-
-                for emy in emys:
-                    if emy.state == "stop" and tmr%emy.interval == 0:
-                        # 敵機が停止状態に入ったら，intervalに応じて爆弾投下
-                        bombs.add(Bomb(emy,None,bird))
-                
-                if  score.value >= (100 + score_tmp) and not boss_spown:
-                    boss_spown = True
-                    bosses.add(Boss())
-
-                for boss in bosses:
-                    if boss.state == "stop" and tmr%boss.interval == 0:
-                        # ボスが停止状態に入ったら、intervalに応じて爆弾投下
-                        bombs.add(Bomb(emy,boss,bird))
-
-                for emy in pg.sprite.groupcollide(emys, beams, True, True).keys():
-                    exps.add(Explosion(emy, 100))  # 爆発エフェクト
-                    score.value += 10  # 10点アップ
-                    mp.increase(1)  # MPを1増加
-                    bird.change_img(6, screen)  # こうかとん喜びエフェクト
-
-                for emy in pg.sprite.groupcollide(emys, BIG_beams,  True, True).keys():
-                    exps.add(Explosion(emy, 100))  # 爆発エフェクト
-                    score.value += 10  # 10点アップ
-                    bird.change_img(6, screen)
-
-                for emy in pg.sprite.groupcollide(emys, enhanced_image_beams,  True, True).keys():
-                    exps.add(Explosion(emy, 100))  # 爆発エフェクト
-                    score.value += 10  # 10点アップ
-                    bird.change_img(6, screen)  # こうかとん喜びエフェクト
-
-                for emy in pg.sprite.groupcollide(emys, Strong_Beam,  True, False).keys():
-                    exps.add(Explosion(emy, 100))  # 爆発エフェクト
-                    score.value += 10  # 10点アップ
-                    bird.change_img(6, screen)  # こうかとん喜びエフェクト
-
-                for bomb in pg.sprite.groupcollide(bombs, beams, True, True).keys():
-                    exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-                    score.value += 1  # 1点アップ
-
-                for boss in pg.sprite.groupcollide(bosses, beams, None, True).keys():
-                    if boss.hp <= 10:
-                        exps.add(Explosion(boss, 50))  # 爆発エフェクト
-                        score.value += 50  # 50点アップ
-                        boss.kill()
-                        score_tmp = score.value
-                        boss_spown = False
-                    elif boss.hp > 0:  # ボスの体力が0より大きかったら
-                        boss.hp -= 10  # ボスの体力を10減らす
-
-                for bomb in pg.sprite.groupcollide(bombs, enhanced_image_beams, True, False).keys():
-                    exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-                    score.value += 1  # 1点アップ
-
-                for bomb in pg.sprite.groupcollide(bombs, BIG_beams, True, True).keys():
-                    exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-                    score.value += 1  # 1点アップ
-                
-                for bomb in pg.sprite.groupcollide(bombs, Strong_Beam, True, False).keys():
-                    exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-                    score.value += 1  # 1点アップ
-
-                for bomb in pg.sprite.groupcollide(bosses, enhanced_image_beams, None, False).keys():
-                    if boss.hp <= 10:
-                        exps.add(Explosion(boss, 50))  # 爆発エフェクト
-                        score.value += 50  # 50点アップ
-                        boss.kill()
-                        score_tmp = score.value
-                        boss_spown = False
-                    elif boss.hp > 0:  # ボスの体力が0より大きかったら
-                        boss.hp -= 0.5  # ボスの体力を10減らす
-
-                for bomb in pg.sprite.groupcollide(bosses, BIG_beams, None, True).keys():
-                    if boss.hp <= 10:
-                        exps.add(Explosion(boss, 50))  # 爆発エフェクト
-                        score.value += 50  # 50点アップ
-                        boss.kill()
-                        score_tmp = score.value
-                        boss_spown = False
-                    elif boss.hp > 0:  # ボスの体力が0より大きかったら
-                        boss.hp -= 5  # ボスの体力を10減らす
-                
-                for bomb in pg.sprite.groupcollide(bosses, Strong_Beam, None, False).keys():
-                    if boss.hp <= 10:
-                        exps.add(Explosion(boss, 50))  # 爆発エフェクト
-                        score.value += 50  # 50点アップ
-                        boss.kill()
-                        score_tmp = score.value
-                        boss_spown = False
-                    elif boss.hp > 0:  # ボスの体力が0より大きかったら
-                        boss.hp -= 0.8  # ボスの体力を10減らす
-
-                if len(pg.sprite.spritecollide(bird, bombs, True)) != 0:
-                    bird.change_img(8, screen) # こうかとん悲しみエフェクト
-                    score.update(screen)
-                    pg.display.update()
+                pending += events
+                # 経過時間分のtickを進める（遅れすぎたら追いつくのをあきらめる）
+                acc = min(acc, tick_ms*Game.max_ticks)
+                ticks = int(acc // tick_ms)
+                acc -= ticks*tick_ms
+                if not game.frame(pg.key.get_pressed(), pending, ticks, acc/tick_ms):
+                    if game.recorder is not None:
+                        game.recorder.close(game)
+                    game.show_defeat()
+                    if render_stats:
+                        print(f"render: {game.renderer.stats()}")
                     time.sleep(2)
                     flag = "gameover"
-                    rank.update(score.value, txt_give)
+                    score = game.score
+                    rank.update(score.value, txt_give, game.lv.lv, game.tmr)
                     break
-                
-                bosses.update()
-                bosses.draw(screen)
-                for boss in bosses:
-                    boss.update()
-                    boss.draw_hp_bar(screen)
-                bird.update(key_lst, screen)
-                beams.update()
-                beams.draw(screen)
-                BIG_beams.update()# 強化ビーム1の更新
-                BIG_beams.draw(screen)# 強化ビーム1の描画
-                enhanced_image_beams.update()  # 強化ビーム2の更新
-                enhanced_image_beams.draw(screen)  # 強化ビーム2の描画
-                Strong_Beam.update()
-                Strong_Beam.draw(screen)
-                emys.update()
-                emys.draw(screen)
-                bombs.update()
-                bombs.draw(screen)
-                exps.update()
-                exps.draw(screen)
-                score.update(screen)
-                score.update(screen)  # スコアを更新
-                mp.update(screen)  # MPを更新
-                lv.update(screen, tmr)
-                pg.display.update()
-                Beam.cooltime_update()
-                tmr += 1
-                if e_cooltime >0:
-                    e_cooltime -= 1
-                clock.tick(50)
+                if ticks:
+                    pending = []
+                clock.tick(fps)
+                now = time.perf_counter()  # clock.tickはミリ秒単位に丸めるので経過時間は別に測る
+                acc += (now - last)*1000
+                last = now
 
 
 if __name__ == "__main__":
+    startup.mark("import")
+    parser = argparse.ArgumentParser(description="こうかとんインベーダー")
+    parser.add_argument("--asset-stats", action="store_true",
+                        help="画像キャッシュのヒット／ミス統計を表示する")
+    parser.add_argument("--render", choices=["dirty", "full"], default="dirty",
+                        help="描画方式（dirty：差分矩形のみ更新，full：毎フレーム全画面更新）")
+    parser.add_argument("--render-stats", action="store_true",
+                        help="1フレームあたりの転送画素数を表示する")
+    parser.add_argument("--headless", action="store_true",
+                        help="画面を表示せずにゲームを最高速度でシミュレーションする")
+    parser.add_argument("--frames", type=int, default=3000,
+                        help="--headless時にシミュレーションするフレーム数")
+    parser.add_argument("--seed", type=int, default=0, help="--headless時の乱数シード")
+    parser.add_argument("--script", help="--headless時に使う入力スクリプトファイル（省略時はボット）")
+    parser.add_argument("--profile", action="store_true",
+                        help="フェーズごとの処理時間を画面に表示する（ゲーム中にF3キーでも切り替え）")
+    parser.add_argument("--profile-csv", help="フレームごとの処理時間とスプライト数を書き出すCSVファイル")
+    parser.add_argument("--pool-size", type=int, default=256,
+                        help="ビーム・爆弾・爆発をクラスごとに再利用する最大数（0でプールしない）")
+    parser.add_argument("--pool-stats", action="store_true", help="終了時にプールの統計を表示する")
+    parser.add_argument("--projectiles", choices=["sprite", "numpy"], default="sprite",
+                        help="ビーム・爆弾の持ち方（numpy：配列でまとめて移動・衝突判定する，NumPyが必要）")
+    parser.add_argument("--effects", choices=["particles", "sprite"], default=Game.effects,
+                        help="爆発エフェクトの持ち方（particles：炎と火花を配列でまとめて動かす（NumPyが必要），"
+                             "sprite：爆発ごとのスプライト（既定））")
+    parser.add_argument("--frame-budget", type=float, metavar="MS",
+                        help="1フレームの処理時間の予算（ミリ秒，既定は--fpsの1フレーム，0で品質を下げない）．"
+                             "超え続けると爆発・HUD・HPバーの描画を段階的に減らす")
+    parser.add_argument("--enemy-budget", type=int, default=0,
+                        help="画面にいられる敵機の最大数（0で上限なし）")
+    parser.add_argument("--enemy-policy", choices=EnemyBudget.policies, default="oldest",
+                        help="上限に達したときの扱い（cap：出さない，oldest：古い敵機を退場させる，merge：古い敵機に合体させる）")
+    parser.add_argument("--rank-store", choices=["sqlite", "file"], default="sqlite",
+                        help="ランキングの保存先（sqlite：全ゲームを記録，file：上位10件のテキストファイル）")
+    parser.add_argument("--rank-report", nargs="?", const="", metavar="NAME",
+                        help="ランキングの集計（NAMEを指定するとそのプレイヤーの記録）を表示して終わる")
+    parser.add_argument("--fps", type=int, default=50,
+                        help="描画の最大フレームレート（0で上限なし）．ゲームの進行は常に50tick/秒")
+    parser.add_argument("--screen-stats", action="store_true",
+                        help="終了時に画面ごとのCPU使用率を表示する")
+    parser.add_argument("--startup-stats", action="store_true",
+                        help="起動から最初の画面を表示するまでの段階ごとの時間を表示する")
+    parser.add_argument("--atlas-cache", default=ATLAS_CACHE, metavar="FILE",
+                        help="加工済み画像のアトラスのキャッシュファイル（空文字ならキャッシュせず毎回作る）．"
+                             "ゲーム画面でだけ使い，--headless・--replayでは使わない")
+    parser.add_argument("--record", metavar="FILE",
+                        help="ゲームの乱数シードと入力をリプレイファイルに記録する（--headless時は最初のゲームだけ）")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="リプレイファイルを再生する（--headlessなら画面なしで最高速度）")
+    args = parser.parse_args()
+    configure_pools(args.pool_size)
+    ATLAS_CACHE = args.atlas_cache
+    budget = EnemyBudget(args.enemy_budget, args.enemy_policy)
+    Game.effects = args.effects
+    if args.frame_budget is None:
+        args.frame_budget = 1000/(args.fps or Game.tick_rate)
+    if args.rank_report is not None:
+        print_rank_report(open_rank(args.rank_store), args.rank_report)
+        sys.exit(0)
+    if args.headless:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
     pg.init()
-    main()
+    startup.mark("pg.init")
+    profiler = FrameProfiler(args.profile_csv, overlay=args.profile, budget=args.frame_budget)
+    if args.replay:
+        result = run_replay(args.replay, not args.headless, args.render, profiler, args.projectiles,
+                            args.frame_budget)
+        for key, value in result.items():
+            print(f"{key}: {value}")
+    elif args.headless:
+        inputs = ScriptedInput.from_file(args.script) if args.script else None
+        result = run_headless(args.frames, args.seed, inputs, args.render, profiler, args.projectiles,
+                              args.record, budget, args.frame_budget)
+        for key, value in result.items():
+            print(f"{key}: {value}")
+    else:
+        meter = ScreenMeter()
+        main(asset_stats=args.asset_stats, render_mode=args.render, render_stats=args.render_stats,
+             profiler=profiler, meter=meter, fps=args.fps,
+             projectiles=args.projectiles, rank_store=args.rank_store, record=args.record,
+             startup_stats=args.startup_stats, budget=budget, frame_budget=args.frame_budget)
+        if args.screen_stats:
+            for name, (wall, cpu, usage) in meter.report().items():
+                print(f"screen {name}: {wall:.1f} s, cpu {cpu:.2f} s ({usage:.1f}%)")
+    profiler.close()
+    if args.pool_stats:
+        for name, stats in pool_stats().items():
+            print(f"pool {name}: {stats}")
+    if args.asset_stats:
+        print(f"assets at exit: {assets.stats()}")
     pg.quit()
     sys.exit()